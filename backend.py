@@ -1,31 +1,302 @@
-import modal
 import json
+import os
+import threading
+import time
+import uuid
 from datetime import datetime
 
-app = modal.App("concept-learning-backend")
+try:
+    import modal
+except ImportError:  # local runs (see loadtest.py) use LocalVolume instead
+    modal = None
 
 
-volume = modal.Volume.from_name("experiment_responses", create_if_missing=True)
+DATA_DIR = "/data"
 
-@app.function(volumes={"/data": volume})
-@modal.fastapi_endpoint(method="POST", docs=True)
-def submit(request: dict):
+# Summary tables live in a subdirectory so that copying the raw *.json files
+# into behavioral_responses/ never picks them up. Each container folds the
+# submissions it saves into its own shard:
+#   _aggregate/<shard>.json   count tables
+#   _aggregate/<shard>.log    saved filenames, one per line, in save order
+# A shard has a single writer, so containers never overwrite each other's
+# counts, and a log only ever grows, so byte offsets into it are stable
+# cursors. Reads merge all shards.
+SUMMARY_DIR = "_aggregate"
+
+RESPONSE_TYPES = ["additive", "subtractive", "mixed", "nochange"]
+RT_BIN_MS = 1000
+RT_NUM_BINS = 120  # last bin collects everything >= (RT_NUM_BINS - 1) * RT_BIN_MS
+
+
+class SummaryShard:
     """
+    One container's share of the summary tables. The lock serializes the
+    container's own concurrent requests; other containers write other shards.
     """
-   
-    try:
-        data = request
-    except Exception as e:
-        return {"status": "error", "message": f"Invalid JSON body: {str(e)}"}
 
-    # Timestamped filename
+    def __init__(self, name: str = None):
+        self.name = name or uuid.uuid4().hex[:12]
+        self.lock = threading.Lock()
+
+
+_shard = SummaryShard()  # this container's shard
+
+
+def save_submission(data: dict, volume, data_dir: str = DATA_DIR, shard: SummaryShard = None):
+    """
+    Write one participant submission to the volume, fold it into this
+    container's summary shard and commit.
+
+    The filename is the UTC timestamp plus a short random suffix, so two
+    participants finishing in the same microsecond never overwrite each other.
+    """
+    shard = shard or _shard
+
     timestamp = datetime.utcnow().isoformat().replace(":", "-")
-    filename = f"/data/{timestamp}.json"
+    name = f"{timestamp}-{uuid.uuid4().hex[:8]}.json"
+    filename = os.path.join(data_dir, name)
 
-    # Write JSON file to the volume
-    with open(filename, "w") as f:
+    # Write JSON file to the volume. Readers never see a partial file.
+    tmp = f"{filename}.tmp"
+    with open(tmp, "w") as f:
         json.dump(data, f, indent=2)
+    os.replace(tmp, filename)
+
+    with shard.lock:
+        summary = load_shard(shard.name, data_dir)
+        fold_submission(summary, name, data)
+        os.makedirs(os.path.join(data_dir, SUMMARY_DIR), exist_ok=True)
+        with open(_shard_path(shard.name, data_dir, ".log"), "ab") as f:
+            f.write(f"{name}\n".encode("utf-8"))
+            summary["log_bytes"] = f.tell()
+        write_shard(summary, shard.name, data_dir)
 
     volume.commit()
 
-    return {"status": "ok", "saved_as": filename}
\ No newline at end of file
+    return {"status": "ok", "saved_as": filename}
+
+
+# ---------------------------------------------------------------------------
+# Summary tables
+# ---------------------------------------------------------------------------
+
+def empty_summary():
+    return {
+        "participants": 0,
+        "responses": 0,
+        "rt_bin_ms": RT_BIN_MS,
+        "by_condition": {},
+        "by_trial": {},
+        "rt_histogram": {},
+    }
+
+
+def _shard_path(shard: str, data_dir: str, ext: str):
+    return os.path.join(data_dir, SUMMARY_DIR, shard + ext)
+
+
+def _shard_names(data_dir):
+    try:
+        fnames = os.listdir(os.path.join(data_dir, SUMMARY_DIR))
+    except FileNotFoundError:
+        return []
+    return sorted(fname[:-len(".log")] for fname in fnames if fname.endswith(".log"))
+
+
+def load_shard(shard: str, data_dir: str = DATA_DIR):
+    """One shard's tables; "log_bytes" is the length of its log they cover."""
+    try:
+        with open(_shard_path(shard, data_dir, ".json"), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {**empty_summary(), "log_bytes": 0}
+
+
+def write_shard(summary, shard: str, data_dir: str = DATA_DIR):
+    path = _shard_path(shard, data_dir, ".json")
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(summary, f)
+    os.replace(tmp, path)
+
+
+def _add_counts(total: dict, part: dict):
+    for key, counts in part.items():
+        row = total.setdefault(key, dict.fromkeys(RESPONSE_TYPES, 0))
+        for rtype, n in counts.items():
+            row[rtype] = row.get(rtype, 0) + n
+
+
+def load_summary(data_dir: str = DATA_DIR):
+    """
+    The summary tables of all shards merged, plus the cursor (see
+    read_summary) of the last submission they include.
+    """
+    summary = empty_summary()
+    offsets = {}
+    for shard in _shard_names(data_dir):
+        part = load_shard(shard, data_dir)
+        summary["participants"] += part["participants"]
+        summary["responses"] += part["responses"]
+        _add_counts(summary["by_condition"], part["by_condition"])
+        _add_counts(summary["by_trial"], part["by_trial"])
+        for cond, hist in part["rt_histogram"].items():
+            total = summary["rt_histogram"].setdefault(cond, [0] * RT_NUM_BINS)
+            summary["rt_histogram"][cond] = [a + b for a, b in zip(total, hist)]
+        offsets[shard] = part["log_bytes"]
+    summary["cursor"] = _format_cursor(offsets)
+    return summary
+
+
+def submission_records(name: str, data: dict):
+    """Flatten one submission into the rows model_fit.load_human_data builds."""
+    pid = name.replace(".json", "")
+    return [
+        {
+            "participant": pid,
+            "trial_id": r["trial_id"],
+            "response_type": r["response_type"],
+            "condition": r.get("condition", "unknown"),
+            "rt_ms": r.get("rt_ms"),
+        }
+        for r in data.get("responses", [])
+    ]
+
+
+def fold_submission(summary, name: str, data: dict):
+    """Add one submission's responses to the summary tables in place."""
+    for rec in submission_records(name, data):
+        cond, rtype = rec["condition"], rec["response_type"]
+
+        by_cond = summary["by_condition"].setdefault(cond, dict.fromkeys(RESPONSE_TYPES, 0))
+        by_cond[rtype] = by_cond.get(rtype, 0) + 1
+
+        by_trial = summary["by_trial"].setdefault(rec["trial_id"], dict.fromkeys(RESPONSE_TYPES, 0))
+        by_trial[rtype] = by_trial.get(rtype, 0) + 1
+
+        if isinstance(rec["rt_ms"], (int, float)):
+            hist = summary["rt_histogram"].setdefault(cond, [0] * RT_NUM_BINS)
+            b = min(max(int(rec["rt_ms"] // RT_BIN_MS), 0), RT_NUM_BINS - 1)
+            hist[b] += 1
+
+        summary["responses"] += 1
+
+    summary["participants"] += 1
+
+
+def _format_cursor(offsets: dict):
+    return ",".join(f"{shard}:{offset}" for shard, offset in sorted(offsets.items()))
+
+
+def _parse_cursor(cursor: str):
+    offsets = {}
+    for part in filter(None, cursor.split(",")):
+        shard, offset = part.rsplit(":", 1)
+        offsets[shard] = int(offset)
+    return offsets
+
+
+def read_summary(data_dir: str = DATA_DIR, since: str = None):
+    """
+    Return the summary tables, or with `since` the raw response records of
+    every submission logged after that cursor ("" for all).
+
+    The cursor holds a byte offset into each shard's log. Logs only grow and
+    become visible in the order they were written, so a submission that
+    shows up late (committed after a newer one) is still delivered. Either
+    way the response carries the cursor to pass next time.
+    """
+    if since is None:
+        return load_summary(data_dir)
+
+    offsets = _parse_cursor(since)
+    records = []
+    for shard in _shard_names(data_dir):
+        start = offsets.get(shard, 0)
+        with open(_shard_path(shard, data_dir, ".log"), "rb") as f:
+            f.seek(start)
+            chunk = f.read()
+        end = chunk.rfind(b"\n") + 1  # only whole lines; the rest comes next time
+        for fname in chunk[:end].decode("utf-8").splitlines():
+            try:
+                with open(os.path.join(data_dir, fname), "r") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            records.extend(submission_records(fname, data))
+        offsets[shard] = start + end
+
+    return {"cursor": _format_cursor(offsets), "records": records}
+
+
+class LocalVolume:
+    """
+    In-process stand-in for modal.Volume backed by a local directory.
+
+    commit() only counts calls (it may be called from several request
+    threads); pass commit_delay to simulate the latency of a real volume
+    commit.
+    """
+
+    def __init__(self, root: str, commit_delay: float = 0.0):
+        self.root = root
+        self.commit_delay = commit_delay
+        self.commits = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def commit(self):
+        if self.commit_delay:
+            time.sleep(self.commit_delay)
+        with self._lock:
+            self.commits += 1
+
+    def reload(self):
+        pass
+
+
+def create_local_app(volume: LocalVolume, shard: SummaryShard = None):
+    """
+    Build the same FastAPI app Modal serves for `submit` (POST /) and
+    `summary` (GET /summary), backed by a LocalVolume. Each app stands in for
+    one container and folds into its own summary shard. Used for load tests
+    and offline development.
+    """
+    shard = shard or SummaryShard()
+    from fastapi import FastAPI
+
+    web_app = FastAPI()
+
+    @web_app.post("/")
+    def submit_local(request: dict):
+        return save_submission(request, volume, volume.root, shard)
+
+    @web_app.get("/summary")
+    def summary_local(since: str = None):
+        return read_summary(volume.root, since)
+
+    return web_app
+
+
+if modal is not None:
+    app = modal.App("concept-learning-backend")
+
+    volume = modal.Volume.from_name("experiment_responses", create_if_missing=True)
+
+    @app.function(volumes={DATA_DIR: volume})
+    @modal.fastapi_endpoint(method="POST", docs=True)
+    def submit(request: dict):
+        """
+        Save one participant's responses (the EndScreen payload) to the volume.
+        """
+        return save_submission(request, volume)
+
+    @app.function(volumes={DATA_DIR: volume})
+    @modal.fastapi_endpoint(method="GET", docs=True)
+    def summary(since: str = None):
+        """
+        Response-type counts per condition and per trial plus RT histograms.
+        With ?since=<cursor>, only the records added after that cursor.
+        """
+        volume.reload()
+        return read_summary(since=since)
@@ -0,0 +1,257 @@
+"""
+Micro- and macro-benchmarks for the model and fitting pipeline.
+
+Benchmarks:
+- micro: log_posterior, propose, run_chain (plain call, and with per-trial tables)
+- macro: run_experiment_parametric at several chain and step counts,
+  grid_search_fit on a reduced grid
+- I/O: load_human_data on synthetic participant folders, save_json/save_csv
+
+Every benchmark reports the best of --repeats runs, each run timing enough
+calls to take at least 0.2 s (timeit autorange). Results are written as
+JSON and can be compared against a stored baseline; any benchmark slower
+than baseline * (1 + threshold) counts as a regression and the script exits
+with status 1. Benchmarks missing from the baseline, and a baseline recorded
+on another platform or Python version, are reported.
+
+Usage:
+    python benchmark.py                                  # quick sizes
+    python benchmark.py --scaling                        # sweep data sizes
+    python benchmark.py --save-baseline                  # store as baseline
+    python benchmark.py --baseline results/benchmark_baseline.json --threshold 0.2
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+from datetime import datetime
+
+from run_model import (
+    correct_table,
+    exact_posterior_table,
+    load_stimuli,
+    log_posterior,
+    propose,
+    run_chain,
+    run_experiment_parametric,
+    save_csv,
+    save_json,
+    trial_count_stats,
+)
+from model_fit import grid_search_fit, load_human_data
+
+
+BASELINE_FILE = "results/benchmark_baseline.json"
+
+QUICK = {
+    "chains": [10, 50],
+    "steps": [100, 500],
+    "participants": [10, 100, 1000],
+    "records": [1000, 10000],
+}
+
+SCALING = {
+    "chains": [10, 50, 100, 200],
+    "steps": [50, 100, 200, 500, 800],
+    "participants": [10, 100, 1000, 10000],
+    "records": [1000, 10000, 100000],
+}
+
+REDUCED_GRID = [
+    {"p_add": p_add, "steps": 100, "temperature": temp}
+    for p_add in (0.3, 0.7) for temp in (1.0, 2.0)
+]
+
+
+def _reset():
+    random.seed(0)
+    gc.enable()  # timeit disables it; the pipeline runs with it on
+
+
+def timed(fn, repeats):
+    """
+    Best wall time per call over `repeats` runs. The number of calls per run
+    is scaled (timeit autorange) so that millisecond-scale benchmarks are not
+    dominated by timer noise. Returns (seconds, calls per run).
+    """
+    timer = timeit.Timer(fn, setup=_reset)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeats, number)) / number, number
+
+
+def write_participants(folder, n, trials, seed=0):
+    """n synthetic behavioral_responses files shaped like real submissions."""
+    rng = random.Random(seed)
+    conditions = ["normal"] * 3 + ["time_pressure"] * 3 + ["add_subtract_reminder"] * 3
+    for p in range(n):
+        responses = []
+        for i, trial in enumerate(rng.sample(trials, len(trials))):
+            responses.append({
+                "trial_id": trial.id,
+                "initial_hypothesis": trial.hypothesis,
+                "response_hypothesis": trial.hypothesis[:-1],
+                "response_type": rng.choice(["additive", "subtractive"]),
+                "condition": conditions[i % len(conditions)],
+                "rt_ms": rng.randint(2000, 60000),
+            })
+        with open(os.path.join(folder, f"participant-{p:06d}.json"), "w") as f:
+            json.dump({"responses": responses}, f, indent=2)
+
+
+def run_benchmarks(sizes, repeats=3):
+    objects, obj_by_id, trials = load_stimuli("../src/stimuli.json")
+    trial = trials[0]
+    results = {}
+
+    def record(name, timing, **info):
+        seconds, number = timing
+        results[name] = {"seconds": seconds, "number": number, **info}
+        print(f"  {name:55s} {seconds * 1e3:12.4f} ms  (x{number})")
+
+    print("Micro-benchmarks")
+    h = trial.hypothesis
+    record("log_posterior",
+           timed(lambda: log_posterior(h, trial.examples, obj_by_id), repeats))
+    record("propose", timed(lambda: propose(h, 0.5), repeats))
+    # The public call, and with tables built once per trial as
+    # run_experiment_parametric does
+    lp_table = exact_posterior_table(trial, obj_by_id)
+    correct = correct_table(trial_count_stats(trial, obj_by_id))
+    for steps in sizes["steps"]:
+        record(f"run_chain[steps={steps}]",
+               timed(lambda: run_chain(trial, "bench", 0.5, steps, 1.0, 0, obj_by_id),
+                     repeats),
+               steps=steps)
+        record(f"run_chain_tables[steps={steps}]",
+               timed(lambda: run_chain(trial, "bench", 0.5, steps, 1.0, 0, obj_by_id,
+                                       lp_table=lp_table, correct=correct), repeats),
+               steps=steps)
+
+    print("Macro-benchmarks")
+    for chains in sizes["chains"]:
+        for steps in sizes["steps"]:
+            record(f"run_experiment_parametric[chains={chains},steps={steps}]",
+                   timed(lambda: run_experiment_parametric(
+                       trials, obj_by_id, p_add=0.5, steps=steps, temperature=1.0,
+                       num_chains=chains), repeats),
+                   chains=chains, steps=steps)
+
+    tmp = tempfile.mkdtemp()
+    try:
+        human_dir = os.path.join(tmp, "human")
+        os.mkdir(human_dir)
+        write_participants(human_dir, 10, trials)
+        human_df = load_human_data(human_dir)
+        out_csv = os.path.join(tmp, "grid.csv")
+
+        def fit():
+            with contextlib.redirect_stdout(io.StringIO()):
+                grid_search_fit(human_df, trials, obj_by_id, configs=REDUCED_GRID,
+                                out_csv=out_csv)
+        record(f"grid_search_fit[configs={len(REDUCED_GRID)}]",
+               timed(fit, repeats), configs=len(REDUCED_GRID))
+
+        print("I/O benchmarks")
+        for n in sizes["participants"]:
+            folder = os.path.join(tmp, f"participants-{n}")
+            os.mkdir(folder)
+            write_participants(folder, n, trials)
+            record(f"load_human_data[participants={n}]",
+                   timed(lambda: load_human_data(folder), repeats),
+                   participants=n)
+
+        random.seed(0)
+        pool = run_experiment_parametric(trials, obj_by_id, p_add=0.5, steps=100,
+                                         temperature=1.0, num_chains=100)
+        for n in sizes["records"]:
+            rows = [pool[i % len(pool)] for i in range(n)]
+            path = os.path.join(tmp, "out")
+            record(f"save_json[records={n}]",
+                   timed(lambda: save_json(rows, path + ".json"), repeats), records=n)
+            record(f"save_csv[records={n}]",
+                   timed(lambda: save_csv(rows, path + ".csv"), repeats), records=n)
+    finally:
+        shutil.rmtree(tmp)
+
+    return results
+
+
+def compare(results, meta, baseline, threshold):
+    """Names of benchmarks slower than baseline * (1 + threshold)."""
+    regressions = []
+    print(f"\nComparison with baseline (threshold +{threshold:.0%})")
+    base_meta = baseline.get("meta", {})
+    for key in ("platform", "python"):
+        if base_meta.get(key) != meta[key]:
+            print(f"  WARNING: baseline {key} {base_meta.get(key)!r} differs from "
+                  f"this run ({meta[key]!r}); ratios may not be meaningful")
+    for name, cur in results.items():
+        base = baseline["benchmarks"].get(name)
+        if base is None:
+            print(f"  {name:55s}   (not in baseline)")
+            continue
+        ratio = cur["seconds"] / base["seconds"]
+        flag = "REGRESSION" if ratio > 1 + threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"  {name:55s} {ratio:6.2f}x {flag}")
+    for name in baseline["benchmarks"]:
+        if name not in results:
+            print(f"  {name:55s}   (not run)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the model and fitting code.")
+    parser.add_argument("--scaling", action="store_true", help="sweep larger data sizes")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--out", default="results/benchmark.json")
+    parser.add_argument("--baseline", default=None, help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="allowed slowdown relative to the baseline")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help=f"also write the results to {BASELINE_FILE}")
+    args = parser.parse_args()
+
+    sizes = SCALING if args.scaling else QUICK
+    results = run_benchmarks(sizes, repeats=args.repeats)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "mode": "scaling" if args.scaling else "quick",
+            "repeats": args.repeats,
+        },
+        "benchmarks": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nSaved: {args.out}")
+
+    if args.save_baseline:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved: {BASELINE_FILE}")
+
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+        regressions = compare(results, report["meta"], baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regressions.")
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
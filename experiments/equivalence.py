@@ -0,0 +1,419 @@
+"""
+Equivalence checks between the reference chain and faster chain engines.
+
+The reference is reference_chain below: the original list-based MCMC
+(propose() + log_posterior() at every step), kept as the semantic oracle
+for run_chain and every faster path. An engine is any function with
+run_chain's signature. Each engine is run next to the reference on
+src/stimuli.json and on randomly generated stimulus sets, and checked
+three ways:
+- Record invariants: every record has the reference's fields, the
+  response_type matches the initial/final hypotheses, accuracy matches the
+  final hypothesis, and additive_moves - subtractive_moves equals the change
+  in length
+- Exact replay (engines that score hypotheses bit-identically and consume
+  the RNG exactly like the reference): with the same seed every record must
+  be identical
+- Distributions: with independent seeds, response types, final hypotheses
+  and move counters per trial are compared with chi-square homogeneity
+  tests. Bonferroni correction keeps the family-wise false-alarm rate at
+  --alpha for the whole run.
+
+Note: the "none" move cannot occur with the four-dimension feature
+set (an empty hypothesis can always add), so it is only covered through
+the invariants.
+
+Usage:
+    python equivalence.py --engine run_chain --random-sets 3
+"""
+
+import argparse
+import math
+import random
+from collections import Counter
+from itertools import product
+
+from run_model import (
+    ALL_FEATURES,
+    DIMENSION_FEATURES,
+    LAMBDA,
+    NOISE,
+    Example,
+    Obj,
+    Trial,
+    build_count_stats,
+    correct_table,
+    feature_dim,
+    load_stimuli,
+    log_posterior,
+    posterior_table,
+    predicts,
+    propose,
+    run_chain,
+)
+
+
+# (p_add, steps, temperature) settings each engine is checked at
+SETTINGS = [
+    (0.5, 50, 1.0),
+    (0.1, 20, 0.5),
+    (0.9, 100, 2.0),
+]
+
+
+# ---- Engines ----
+
+def reference_chain(trial, condition_name, p_add, steps, temperature, chain_idx, obj_by_id,
+                    lam=LAMBDA, noise=NOISE):
+    """The original list-based run_chain."""
+    current_h = trial.hypothesis.copy()
+    current_lp = log_posterior(current_h, trial.examples, obj_by_id, lam, noise)
+
+    add_moves = 0
+    sub_moves = 0
+
+    for _ in range(steps):
+        proposal, move_type = propose(current_h, p_add)
+        if move_type == "none":
+            continue
+
+        prop_lp = log_posterior(proposal, trial.examples, obj_by_id, lam, noise)
+        delta = prop_lp - current_lp
+        accept = min(1.0, math.exp(delta / temperature))
+
+        if random.random() < accept:
+            current_h = proposal
+            current_lp = prop_lp
+            if move_type == "additive": add_moves += 1
+            else: sub_moves += 1
+
+    final_h = current_h
+
+    removed = [f for f in trial.hypothesis if f not in final_h]
+    added   = [f for f in final_h if f not in trial.hypothesis]
+
+    if removed and not added:
+        resp_type = "subtractive"
+    elif added and not removed:
+        resp_type = "additive"
+    elif removed and added:
+        resp_type = "mixed"
+    else:
+        resp_type = "nochange"
+
+    correct = 0
+    for ex in trial.examples:
+        obj = obj_by_id[ex.object_id]
+        pred = 1 if predicts(final_h, obj) else 0
+        correct += int(pred == ex.label)
+
+    return {
+        "trial_id": trial.id,
+        "trial_type": trial.type,
+        "condition": condition_name,
+        "chain_index": chain_idx,
+        "initial_hypothesis": trial.hypothesis,
+        "final_hypothesis": final_h,
+        "final_length": len(final_h),
+        "response_type": resp_type,
+        "additive_moves": add_moves,
+        "subtractive_moves": sub_moves,
+        "accuracy": correct / len(trial.examples),
+    }
+
+
+def make_posterior_table_engine():
+    """run_chain on the posterior-table fast path, tables memoised per trial."""
+    tables = {}
+
+    def engine(trial, condition_name, p_add, steps, temperature, chain_idx, obj_by_id,
+               lam=LAMBDA, noise=NOISE):
+        key = (id(trial), lam, noise)
+        if key not in tables:
+            stats = build_count_stats([trial], obj_by_id)[trial.id]
+            # keep the trial so its id cannot be reused within this engine
+            tables[key] = (trial, posterior_table(stats, lam, noise), correct_table(stats))
+        _, lp_table, correct = tables[key]
+        return run_chain(trial, condition_name, p_add, steps, temperature, chain_idx,
+                         obj_by_id, lam=lam, noise=noise, lp_table=lp_table, correct=correct)
+
+    return engine
+
+
+# name -> (factory, replays reference_chain exactly under the same seed)
+# posterior_table sums the likelihood terms in a different order than
+# log_posterior, so its scores can differ in the last bits; that can flip an
+# accept decision, so it is only checked on distributions.
+ENGINES = {
+    "reference": (lambda: reference_chain, True),
+    "run_chain": (lambda: run_chain, True),
+    "posterior_table": (make_posterior_table_engine, False),
+}
+
+
+# ---- Stimuli ----
+
+def random_stimuli(rng, n_trials=9, n_examples=6):
+    """All 16 objects and n_trials trials with random hypotheses and labels."""
+    objects = [
+        Obj(id=i + 1, shape=shape, color=color, fill=fill, size=size)
+        for i, (shape, color, fill, size) in enumerate(product(*DIMENSION_FEATURES))
+    ]
+    obj_by_id = {o.id: o for o in objects}
+
+    trials = []
+    for t in range(n_trials):
+        dims = rng.sample(DIMENSION_FEATURES, rng.randint(0, len(DIMENSION_FEATURES)))
+        hypothesis = [rng.choice(fs) for fs in dims]
+        concept = [rng.choice(fs) for fs in rng.sample(DIMENSION_FEATURES, rng.randint(1, 3))]
+        examples = []
+        for obj in rng.sample(objects, n_examples):
+            label = int(predicts(concept, obj))
+            if rng.random() < 0.1:
+                label = 1 - label
+            examples.append(Example(object_id=obj.id, label=label))
+        trials.append(Trial(id=f"R{t}", type="random", hypothesis=hypothesis, examples=examples))
+
+    return objects, obj_by_id, trials
+
+
+# ---- Statistics ----
+
+def chi2_sf(x, dof):
+    """Survival function of the chi-square distribution (regularized upper gamma)."""
+    if x <= 0:
+        return 1.0
+    a, x = dof / 2.0, x / 2.0
+    gln = math.lgamma(a)
+    if x < a + 1:
+        # series for the lower incomplete gamma
+        term = total = 1.0 / a
+        ap = a
+        for _ in range(1000):
+            ap += 1
+            term *= x / ap
+            total += term
+            if abs(term) < abs(total) * 1e-15:
+                break
+        return max(0.0, 1.0 - total * math.exp(-x + a * math.log(x) - gln))
+    # continued fraction for the upper incomplete gamma (Lentz)
+    tiny = 1e-300
+    b = x + 1 - a
+    c = 1 / tiny
+    d = 1 / b
+    h = d
+    for i in range(1, 1000):
+        an = -i * (i - a)
+        b += 2
+        d = an * d + b
+        d = tiny if abs(d) < tiny else d
+        c = b + an / c
+        c = tiny if abs(c) < tiny else c
+        d = 1 / d
+        delta = d * c
+        h *= delta
+        if abs(delta - 1) < 1e-15:
+            break
+    return math.exp(-x + a * math.log(x) - gln) * h
+
+
+def chi2_homogeneity(a, b, min_expected=5.0):
+    """
+    Two-sample chi-square test that samples a and b (lists of hashable
+    values) come from the same distribution. Categories with small expected
+    counts are pooled. Returns (statistic, dof, p_value).
+    """
+    ca, cb = Counter(a), Counter(b)
+    na, nb = len(a), len(b)
+    n = na + nb
+
+    cells = []
+    other_a = other_b = 0
+    for cat in set(ca) | set(cb):
+        tot = ca[cat] + cb[cat]
+        if min(na, nb) * tot / n < min_expected:
+            other_a += ca[cat]
+            other_b += cb[cat]
+        else:
+            cells.append((ca[cat], cb[cat]))
+    if other_a + other_b:
+        cells.append((other_a, other_b))
+    if len(cells) < 2:
+        return 0.0, 0, 1.0
+
+    stat = 0.0
+    for xa, xb in cells:
+        tot = xa + xb
+        for obs, nn in ((xa, na), (xb, nb)):
+            exp = nn * tot / n
+            stat += (obs - exp) ** 2 / exp
+    dof = len(cells) - 1
+    return stat, dof, chi2_sf(stat, dof)
+
+
+# ---- Checks ----
+
+def check_record(rec, ref_rec, trial, obj_by_id):
+    """Invariant violations of one engine record (empty list if none)."""
+    problems = []
+    if set(rec) != set(ref_rec):
+        problems.append(f"fields {sorted(rec)} != {sorted(ref_rec)}")
+        return problems
+
+    init, final = rec["initial_hypothesis"], rec["final_hypothesis"]
+    if init != trial.hypothesis:
+        problems.append(f"initial_hypothesis {init} != {trial.hypothesis}")
+    if any(f not in ALL_FEATURES for f in final):
+        problems.append(f"unknown feature in {final}")
+    elif len({feature_dim(f) for f in final}) != len(final):
+        problems.append(f"two features in one dimension: {final}")
+
+    removed = [f for f in init if f not in final]
+    added = [f for f in final if f not in init]
+    expected_type = (
+        "subtractive" if removed and not added else
+        "additive" if added and not removed else
+        "mixed" if removed and added else
+        "nochange"
+    )
+    if rec["response_type"] != expected_type:
+        problems.append(f"response_type {rec['response_type']} != {expected_type}")
+
+    correct = sum(
+        int((1 if predicts(final, obj_by_id[ex.object_id]) else 0) == ex.label)
+        for ex in trial.examples
+    )
+    if rec["accuracy"] != correct / len(trial.examples):
+        problems.append(f"accuracy {rec['accuracy']} != {correct / len(trial.examples)}")
+
+    if rec["final_length"] != len(final):
+        problems.append(f"final_length {rec['final_length']} != {len(final)}")
+    if rec["additive_moves"] - rec["subtractive_moves"] != len(final) - len(init):
+        problems.append("move counters inconsistent with the change in length")
+    if rec["additive_moves"] < 0 or rec["subtractive_moves"] < 0:
+        problems.append("negative move counter")
+
+    return problems
+
+
+def run_chains(engine, trial, obj_by_id, setting, n_chains, seed):
+    p_add, steps, temperature = setting
+    random.seed(seed)
+    return [
+        engine(trial=trial, condition_name=f"p_add={p_add}_steps={steps}_temp={temperature}",
+               p_add=p_add, steps=steps, temperature=temperature,
+               chain_idx=i, obj_by_id=obj_by_id)
+        for i in range(n_chains)
+    ]
+
+
+def compare_on_trial(candidate, exact, trial, obj_by_id, setting, n_chains, seed):
+    """Run reference and candidate on one trial; return (invariant problems, tests)."""
+    problems = []
+
+    ref = run_chains(reference_chain, trial, obj_by_id, setting, n_chains, seed)
+    cand = run_chains(candidate, trial, obj_by_id, setting, n_chains, seed + 1)
+
+    for rec in cand:
+        problems.extend(check_record(rec, ref[0], trial, obj_by_id))
+
+    if exact:
+        replay = run_chains(candidate, trial, obj_by_id, setting, n_chains, seed)
+        ref_same_seed = run_chains(reference_chain, trial, obj_by_id, setting, n_chains, seed + 1)
+        mismatches = sum(r != c for r, c in zip(ref, replay))
+        mismatches += sum(r != c for r, c in zip(ref_same_seed, cand))
+        if mismatches:
+            problems.append(f"{mismatches} records differ from the reference under the same seed")
+
+    tests = []
+    for field in ("response_type", "final_hypothesis", "additive_moves", "subtractive_moves"):
+        def value(rec):
+            v = rec[field]
+            return tuple(sorted(v)) if isinstance(v, list) else v
+        stat, dof, p = chi2_homogeneity([value(r) for r in ref], [value(r) for r in cand])
+        tests.append({"field": field, "stat": stat, "dof": dof, "p": p})
+
+    return problems, tests
+
+
+def check_engine(candidate, exact, stimulus_sets, settings=SETTINGS, n_chains=200,
+                 alpha=0.01, seed=0):
+    """
+    Compare candidate to reference_chain on every (stimulus set, setting, trial).
+    Returns a report dict; report["ok"] is False on any invariant violation,
+    exact-replay mismatch, or a distribution test rejected at the
+    Bonferroni-corrected level.
+    """
+    cases = []
+    for set_name, (obj_by_id, trials) in stimulus_sets.items():
+        for setting in settings:
+            for trial in trials:
+                case_seed = seed + 1000 * len(cases)
+                problems, tests = compare_on_trial(
+                    candidate, exact, trial, obj_by_id, setting, n_chains, case_seed
+                )
+                cases.append({
+                    "stimuli": set_name, "setting": setting, "trial": trial.id,
+                    "problems": problems, "tests": tests,
+                })
+
+    n_tests = sum(len(c["tests"]) for c in cases if c["tests"])
+    threshold = alpha / max(n_tests, 1)
+
+    failures = []
+    for c in cases:
+        for prob in c["problems"]:
+            failures.append((c, prob))
+        for t in c["tests"]:
+            if t["p"] < threshold:
+                failures.append((c, f"{t['field']} distribution differs "
+                                    f"(chi2={t['stat']:.1f}, dof={t['dof']}, p={t['p']:.2e})"))
+
+    return {
+        "ok": not failures,
+        "cases": cases,
+        "n_tests": n_tests,
+        "threshold": threshold,
+        "failures": failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check a chain engine against the reference.")
+    parser.add_argument("--engine", default="run_chain", choices=sorted(ENGINES))
+    parser.add_argument("--random-sets", type=int, default=3,
+                        help="number of random stimulus sets besides stimuli.json")
+    parser.add_argument("--chains", type=int, default=200)
+    parser.add_argument("--alpha", type=float, default=0.01,
+                        help="family-wise false-alarm rate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    factory, exact = ENGINES[args.engine]
+
+    objects, obj_by_id, trials = load_stimuli("../src/stimuli.json")
+    stimulus_sets = {"stimuli.json": (obj_by_id, trials)}
+    rng = random.Random(args.seed)
+    for i in range(args.random_sets):
+        _, r_obj_by_id, r_trials = random_stimuli(rng)
+        stimulus_sets[f"random-{i}"] = (r_obj_by_id, r_trials)
+
+    print(f"Checking engine '{args.engine}' "
+          f"({'exact replay + ' if exact else ''}distribution tests)...")
+    report = check_engine(factory(), exact, stimulus_sets, n_chains=args.chains,
+                          alpha=args.alpha, seed=args.seed)
+
+    print(f"{len(report['cases'])} cases, {report['n_tests']} tests, "
+          f"per-test threshold p < {report['threshold']:.2e}")
+    for case, msg in report["failures"][:50]:
+        print(f"  FAIL [{case['stimuli']} {case['setting']} {case['trial']}] {msg}")
+
+    if report["ok"]:
+        print("Equivalent.")
+    else:
+        print(f"{len(report['failures'])} failures.")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
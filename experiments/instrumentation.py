@@ -0,0 +1,222 @@
+"""
+Optional instrumentation for run_chain.
+
+Pass an instrument to run_chain / run_experiment_parametric. Any object with
+start_chain(trial, chain_idx, h) works; it returns a per-chain recorder with
+step(step, move_type, accepted, h) and finish(h), or None to skip that chain.
+step() is called once per MCMC step with the hypothesis after that step.
+Instruments never touch the RNG, so instrumented runs reproduce
+uninstrumented ones exactly. With instrument=None run_chain only pays two
+`is not None` checks per step.
+
+Built-in instruments:
+- MoveCounters: proposals / acceptances per move type, "none" proposals
+- StepTimer:    wall time per chain and per move type
+- TraceSink:    step-level trajectories in a compact binary log, optionally
+                for only 1 in N chains (read back with read_trace)
+- combine(...): several instruments at once
+
+Example:
+    counters = MoveCounters()
+    trace = TraceSink("results/trace.bin", every=10)
+    run_experiment_parametric(..., instrument=combine(counters, trace))
+    trace.close()
+    print(counters.acceptance_rates())
+"""
+
+import struct
+import time
+from collections import Counter, defaultdict
+
+from run_model import ALL_FEATURES
+
+
+MOVE_CODES = {"none": 0, "additive": 1, "subtractive": 2}
+MOVE_NAMES = {v: k for k, v in MOVE_CODES.items()}
+
+FEATURE_BITS = {f: 1 << i for i, f in enumerate(ALL_FEATURES)}
+
+
+def encode_mask(h):
+    """Hypothesis -> 8-bit feature mask (bit i = ALL_FEATURES[i])."""
+    mask = 0
+    for f in h:
+        mask |= FEATURE_BITS[f]
+    return mask
+
+
+def decode_mask(mask):
+    """8-bit feature mask -> features in ALL_FEATURES order."""
+    return [f for f in ALL_FEATURES if mask & FEATURE_BITS[f]]
+
+
+class MoveCounters:
+    """Counts proposals and acceptances per move type over all chains."""
+
+    def __init__(self):
+        self.counts = Counter()
+
+    def start_chain(self, trial, chain_idx, h):
+        self.counts["chains"] += 1
+        return self
+
+    def step(self, step, move_type, accepted, h):
+        self.counts[f"proposed_{move_type}"] += 1
+        if accepted:
+            self.counts[f"accepted_{move_type}"] += 1
+
+    def finish(self, h):
+        pass
+
+    def acceptance_rates(self):
+        rates = {}
+        for move in ("additive", "subtractive"):
+            proposed = self.counts[f"proposed_{move}"]
+            rates[move] = self.counts[f"accepted_{move}"] / proposed if proposed else float("nan")
+        return rates
+
+
+class StepTimer:
+    """Wall time per chain and per move type (seconds)."""
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = Counter()
+        self._chain_t0 = self._step_t0 = 0.0
+
+    def start_chain(self, trial, chain_idx, h):
+        self._chain_t0 = self._step_t0 = time.perf_counter()
+        return self
+
+    def step(self, step, move_type, accepted, h):
+        now = time.perf_counter()
+        self.totals[move_type] += now - self._step_t0
+        self.counts[move_type] += 1
+        self._step_t0 = now
+
+    def finish(self, h):
+        self.totals["chain"] += time.perf_counter() - self._chain_t0
+        self.counts["chain"] += 1
+
+    def mean_times(self):
+        return {k: self.totals[k] / self.counts[k] for k in self.totals if self.counts[k]}
+
+
+# Binary trace format (little endian):
+#   file header   b"MCMCTRC1"
+#   chain start   B type=0, I chain_idx, B len(trial_id), trial_id (utf-8), B mask
+#   step          B type=1, I step, B move_code | accepted << 2, B mask
+#   chain end     B type=2, B mask
+_HEADER = b"MCMCTRC1"
+_CHAIN = struct.Struct("<BIB")
+_STEP = struct.Struct("<BIBB")
+_END = struct.Struct("<BB")
+
+
+class TraceSink:
+    """
+    Writes step-level trajectories of every `every`-th chain to a binary log.
+    Sampling is by chain count, not by RNG.
+    """
+
+    def __init__(self, path, every=1):
+        self.every = every
+        self._f = open(path, "wb")
+        self._f.write(_HEADER)
+        self._n_chains = 0
+        self._buf = None
+
+    def start_chain(self, trial, chain_idx, h):
+        self._n_chains += 1
+        if (self._n_chains - 1) % self.every:
+            return None
+        tid = trial.id.encode("utf-8")
+        self._buf = bytearray(_CHAIN.pack(0, chain_idx, len(tid)))
+        self._buf += tid
+        self._buf.append(encode_mask(h))
+        return self
+
+    def step(self, step, move_type, accepted, h):
+        self._buf += _STEP.pack(1, step, MOVE_CODES[move_type] | (accepted << 2), encode_mask(h))
+
+    def finish(self, h):
+        self._buf += _END.pack(2, encode_mask(h))
+        self._f.write(self._buf)
+        self._buf = None
+
+    def close(self):
+        self._f.close()
+
+
+def read_trace(path):
+    """
+    Read a TraceSink log. Returns one dict per traced chain with trial_id,
+    chain_index, initial_mask, final_mask and steps as
+    (step, move_type, accepted, mask) tuples.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(_HEADER):
+        raise ValueError(f"Not a trace file: {path}")
+
+    chains = []
+    pos = len(_HEADER)
+    while pos < len(data):
+        kind = data[pos]
+        if kind == 0:
+            _, chain_idx, n = _CHAIN.unpack_from(data, pos)
+            pos += _CHAIN.size
+            trial_id = data[pos:pos + n].decode("utf-8")
+            pos += n
+            chains.append({
+                "trial_id": trial_id,
+                "chain_index": chain_idx,
+                "initial_mask": data[pos],
+                "steps": [],
+            })
+            pos += 1
+        elif kind == 1:
+            _, step, code, mask = _STEP.unpack_from(data, pos)
+            pos += _STEP.size
+            chains[-1]["steps"].append((step, MOVE_NAMES[code & 3], bool(code >> 2), mask))
+        elif kind == 2:
+            _, mask = _END.unpack_from(data, pos)
+            pos += _END.size
+            chains[-1]["final_mask"] = mask
+        else:
+            raise ValueError(f"Corrupt trace record at byte {pos}: {path}")
+    return chains
+
+
+class _CombinedRecorder:
+    def __init__(self, recorders):
+        self.recorders = recorders
+
+    def step(self, step, move_type, accepted, h):
+        for r in self.recorders:
+            r.step(step, move_type, accepted, h)
+
+    def finish(self, h):
+        for r in self.recorders:
+            r.finish(h)
+
+
+class Combined:
+    """Several instruments used in one run; see combine()."""
+
+    def __init__(self, instruments):
+        self.instruments = instruments
+
+    def start_chain(self, trial, chain_idx, h):
+        recorders = [
+            r for r in (i.start_chain(trial, chain_idx, h) for i in self.instruments)
+            if r is not None
+        ]
+        if not recorders:
+            return None
+        return recorders[0] if len(recorders) == 1 else _CombinedRecorder(recorders)
+
+
+def combine(*instruments):
+    """Use several instruments in one run."""
+    return Combined(instruments)
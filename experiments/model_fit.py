@@ -7,20 +7,49 @@ This script performs:
 - Distribution comparison
 - Parameter search (grid or randomized)
 - Saves grid results to CSV for visualization
+- Online refitting as new participants arrive (--online)
+- Multi-node grid search through a shared directory (see work_queue.py)
+- Cross-validated fitting over participants or trials (--cv)
 """
 
+import argparse
+import hashlib
 import json
 import os
+import random
+import time
+import urllib.parse
+import urllib.request
+from dataclasses import dataclass, field
 import numpy as np
 import pandas as pd
 from collections import Counter
 from itertools import product
+from multiprocessing import Pool
 
 from run_model import (
+    LAMBDA,
+    NOISE,
+    build_count_stats,
     load_stimuli,
     run_experiment_parametric
 )
 
+RESPONSE_TYPES = ["additive", "subtractive", "mixed", "nochange"]
+
+P_ADD_VALS = [0.1, 0.3, 0.5, 0.7, 0.9]
+STEPS_VALS = [100, 200, 500, 800]
+TEMP_VALS  = [0.5, 1.0, 1.5, 2.0]
+LAMBDA_VALS = [0.3, 0.7, 1.2, 2.0]
+NOISE_VALS  = [0.01, 0.05, 0.1, 0.2]
+NUM_CHAINS = 50
+
+SIM_CACHE_FILE = "results/model_sim_cache.json"
+# How cached simulations are seeded; part of every cache key, so entries
+# made under a different policy are never reused.
+SIM_SEEDING = "key-v1"
+
+
 def load_human_data(folder="behavioral_responses"):
     rows = []
     for fname in os.listdir(folder):
@@ -70,30 +99,195 @@ def cross_entropy(p, q):
     q = np.array(q) + eps
     return -np.sum(p * np.log(q))
 
+def kl_losses(p, model_dists):
+    """kl_divergence(p, q) for every row q of model_dists."""
+    eps = 1e-9
+    p = np.asarray(p) + eps
+    q = np.asarray(model_dists) + eps
+    return np.sum(p * np.log(p / q), axis=-1)
+
 
-def evaluate_model(params, trials, obj_by_id, human_dist):
+def parallel_map(fn, jobs, workers, initializer, initargs):
     """
-    params: dict with p_add, steps, temperature
-    human_dist: distribution dict
+    pool.map(fn, jobs) over `workers` processes, each set up once by
+    initializer(*initargs). Runs in-process when workers == 1.
+    """
+    if workers == 1 or len(jobs) <= 1:
+        initializer(*initargs)
+        return [fn(job) for job in jobs]
+    chunksize = max(1, len(jobs) // (workers * 8))
+    with Pool(workers, initializer=initializer, initargs=initargs) as pool:
+        return pool.map(fn, jobs, chunksize=chunksize)
 
-    Returns: scalar loss
+
+def config_key(params):
+    """Stable string key for a parameter configuration."""
+    return "|".join(f"{k}={params[k]}" for k in sorted(params))
+
+
+def simulate_model_counts(params, trials, obj_by_id, num_chains=NUM_CHAINS, count_stats=None):
     """
-    p_add = params["p_add"]
-    steps = params["steps"]
-    temp  = params["temperature"]
+    Run the model for one configuration and return per-trial response-type
+    counts: {trial_id: [additive, subtractive, mixed, nochange]}.
 
-    # run model
+    params may also set "lambda" and "noise". Pass count_stats (from
+    run_model.build_count_stats) to use the posterior-table fast path.
+    """
     model_results = run_experiment_parametric(
         trials=trials,
         obj_by_id=obj_by_id,
-        p_add=p_add,
-        steps=steps,
-        temperature=temp,
-        num_chains=50
+        p_add=params["p_add"],
+        steps=params["steps"],
+        temperature=params["temperature"],
+        num_chains=num_chains,
+        lam=params.get("lambda", LAMBDA),
+        noise=params.get("noise", NOISE),
+        count_stats=count_stats,
     )
 
-    df = pd.DataFrame(model_results)
-    model_dist = compute_distribution(df)
+    counts = {t.id: [0] * len(RESPONSE_TYPES) for t in trials}
+    for r in model_results:
+        counts[r["trial_id"]][RESPONSE_TYPES.index(r["response_type"])] += 1
+    return counts
+
+
+def counts_to_dist(trial_counts, trial_ids=None):
+    """Pool per-trial counts (optionally only trial_ids) into a distribution dict."""
+    total = np.zeros(len(RESPONSE_TYPES))
+    for tid, c in trial_counts.items():
+        if trial_ids is None or tid in trial_ids:
+            total += c
+    total = total / total.sum()
+    return dict(zip(RESPONSE_TYPES, total))
+
+
+def load_sim_cache(path=SIM_CACHE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_sim_cache(cache, path=SIM_CACHE_FILE):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp, path)
+
+
+def stimuli_hash(trials, obj_by_id):
+    """Short hash of the stimuli a simulation ran on."""
+    payload = repr((trials, sorted(obj_by_id.items())))
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:12]
+
+
+def sim_cache_key(params, trials, obj_by_id, num_chains=NUM_CHAINS, stimuli=None):
+    """
+    Cache key: parameters, chain count, seeding policy and stimuli. Pass
+    stimuli (from stimuli_hash) when computing many keys.
+    """
+    return config_key({
+        **params,
+        "num_chains": num_chains,
+        "seeding": SIM_SEEDING,
+        "stimuli": stimuli or stimuli_hash(trials, obj_by_id),
+    })
+
+
+def seeded_model_counts(params, trials, obj_by_id, num_chains=NUM_CHAINS, count_stats=None):
+    """
+    simulate_model_counts seeded by the configuration's cache key, always on
+    the posterior-table path. The counts depend only on the key, so it does
+    not matter which tool (fit, cross-validation, recovery, work queue)
+    simulates a configuration first.
+    """
+    if count_stats is None:
+        count_stats = build_count_stats(trials, obj_by_id)
+    random.seed(sim_cache_key(params, trials, obj_by_id, num_chains))
+    return simulate_model_counts(params, trials, obj_by_id, num_chains, count_stats)
+
+
+def cached_model_counts(params, trials, obj_by_id, cache, num_chains=NUM_CHAINS,
+                        count_stats=None):
+    """Per-trial model counts for params, simulated only on a cache miss."""
+    key = sim_cache_key(params, trials, obj_by_id, num_chains)
+    if key not in cache:
+        cache[key] = seeded_model_counts(params, trials, obj_by_id, num_chains, count_stats)
+    return cache[key]
+
+
+_sim = {}
+
+
+def _init_sim(trials, obj_by_id, count_stats):
+    _sim.update(trials=trials, obj_by_id=obj_by_id, count_stats=count_stats)
+
+
+def _simulate_config(params):
+    return seeded_model_counts(params, _sim["trials"], _sim["obj_by_id"],
+                               count_stats=_sim["count_stats"])
+
+
+def fill_sim_cache(configs, trials, obj_by_id, cache, workers=1, count_stats=None):
+    """
+    Simulate every configuration missing from the cache, across `workers`
+    processes. Returns the number of new entries.
+    """
+    stimuli = stimuli_hash(trials, obj_by_id)
+    keys = [sim_cache_key(params, trials, obj_by_id, stimuli=stimuli) for params in configs]
+    missing = [(key, params) for key, params in zip(keys, configs) if key not in cache]
+    if not missing:
+        return 0
+    if count_stats is None:
+        count_stats = build_count_stats(trials, obj_by_id)
+    counts = parallel_map(_simulate_config, [params for _, params in missing], workers,
+                          _init_sim, (trials, obj_by_id, count_stats))
+    for (key, _), c in zip(missing, counts):
+        cache[key] = c
+    return len(missing)
+
+
+def grid_configs(fit_lambda_noise=False):
+    """The fitting grid; with fit_lambda_noise, also over LAMBDA_VALS x NOISE_VALS."""
+    if not fit_lambda_noise:
+        return [
+            {"p_add": p_add, "steps": steps, "temperature": temp}
+            for p_add, steps, temp in product(P_ADD_VALS, STEPS_VALS, TEMP_VALS)
+        ]
+    return [
+        {"p_add": p_add, "steps": steps, "temperature": temp, "lambda": lam, "noise": noise}
+        for p_add, steps, temp, lam, noise
+        in product(P_ADD_VALS, STEPS_VALS, TEMP_VALS, LAMBDA_VALS, NOISE_VALS)
+    ]
+
+
+def best_params_from_row(row):
+    """Parameter dict of one results row, with the types the model expects."""
+    best_params = {
+        "p_add": float(row["p_add"]),
+        "steps": int(row["steps"]),
+        "temperature": float(row["temperature"]),
+    }
+    for k in ("lambda", "noise"):
+        if k in row and not pd.isna(row[k]):
+            best_params[k] = float(row[k])
+    return best_params
+
+
+def evaluate_model(params, trials, obj_by_id, human_dist, cache=None, count_stats=None):
+    """
+    params: dict with p_add, steps, temperature (and optionally lambda, noise)
+    human_dist: distribution dict
+    cache: optional simulation cache (see load_sim_cache)
+    count_stats: optional precomputed count statistics (build_count_stats)
+
+    Returns: scalar loss
+    """
+    if cache is None:
+        counts = seeded_model_counts(params, trials, obj_by_id, count_stats=count_stats)
+    else:
+        counts = cached_model_counts(params, trials, obj_by_id, cache, count_stats=count_stats)
+    model_dist = counts_to_dist(counts)
 
     # Compute chosen metric
     p = dist_to_vec(human_dist)
@@ -102,46 +296,49 @@ def evaluate_model(params, trials, obj_by_id, human_dist):
     return kl_divergence(p, q)
 
 
-def grid_search_fit(human_df, trials, obj_by_id):
+def grid_search_fit(human_df, trials, obj_by_id, cache=None,
+                    fit_lambda_noise=False, n_random=None, seed=0,
+                    configs=None, out_csv="results/model_fit_grid.csv"):
     """
     Simple grid search across p_add, steps, temperature.
     Saves all results into model_fit_grid.csv.
+    Pass a simulation cache to reuse model runs across fits.
+
+    fit_lambda_noise: also search LAMBDA and NOISE (5-D). Chains score
+        hypotheses from precomputed count statistics, so each extra
+        (lambda, noise) pair costs a table reweighting, not example evaluation.
+        Every configuration is seeded by its cache key (seeded_model_counts).
+    n_random: evaluate only this many configurations drawn from the grid.
+    configs: explicit list of parameter dicts to evaluate instead of the grid.
     """
 
     human_dist = compute_distribution(human_df[human_df["condition"] == "normal"])
 
-    p_add_vals = [0.1, 0.3, 0.5, 0.7, 0.9]
-    steps_vals = [100, 200, 500, 800]
-    temp_vals  = [0.5, 1.0, 1.5, 2.0]
+    if configs is None:
+        configs = grid_configs(fit_lambda_noise)
+    if n_random is not None and n_random < len(configs):
+        configs = random.Random(seed).sample(configs, n_random)
+
+    count_stats = build_count_stats(trials, obj_by_id)
 
     results = []
 
     print("Beginning grid search...")
 
-    for p_add, steps, temp in product(p_add_vals, steps_vals, temp_vals):
-        params = {"p_add": p_add, "steps": steps, "temperature": temp}
-        loss = evaluate_model(params, trials, obj_by_id, human_dist)
+    for params in configs:
+        loss = evaluate_model(params, trials, obj_by_id, human_dist, cache, count_stats)
 
-        results.append({
-            "p_add": p_add,
-            "steps": steps,
-            "temperature": temp,
-            "loss": loss
-        })
+        results.append({**params, "loss": loss})
 
         print(f"Tested {params}, Loss={loss:.4f}")
 
     # Convert to DataFrame and save to CSV
     results_df = pd.DataFrame(results)
-    results_df.to_csv("results/model_fit_grid.csv", index=False)
+    results_df.to_csv(out_csv, index=False)
 
     # Identify best-fit parameters
     best_row = results_df.loc[results_df["loss"].idxmin()]
-    best_params = {
-        "p_add": float(best_row["p_add"]),
-        "steps": int(best_row["steps"]),
-        "temperature": float(best_row["temperature"]),
-    }
+    best_params = best_params_from_row(best_row)
     best_loss = float(best_row["loss"])
 
     print("\nBest parameters:", best_params)
@@ -149,7 +346,288 @@ def grid_search_fit(human_df, trials, obj_by_id):
 
     return best_params, results_df
 
+
+@dataclass
+class OnlineFit:
+    """
+    State for refitting as participants arrive. Model distributions are fixed
+    per configuration, so only the human counts change between refits.
+    """
+    configs: list
+    model_dists: np.ndarray            # (n_configs, 4), rows follow RESPONSE_TYPES
+    human_counts: Counter = field(default_factory=Counter)
+    seen_files: set = field(default_factory=set)
+    seen_participants: set = field(default_factory=set)
+    summary_cursor: str = ""
+    condition: str = "normal"
+
+
+def start_online_fit(trials, obj_by_id, cache_file=SIM_CACHE_FILE, fit_lambda_noise=False):
+    """
+    Simulate (or load from the cache) every grid configuration once.
+    """
+    cache = load_sim_cache(cache_file)
+    n_cached = len(cache)
+    configs = grid_configs(fit_lambda_noise)
+    count_stats = build_count_stats(trials, obj_by_id)
+    model_dists = np.array([
+        dist_to_vec(counts_to_dist(
+            cached_model_counts(params, trials, obj_by_id, cache, count_stats=count_stats)
+        ))
+        for params in configs
+    ])
+    if len(cache) != n_cached:
+        save_sim_cache(cache, cache_file)
+    return OnlineFit(configs=configs, model_dists=model_dists)
+
+
+def _add_responses(state, responses):
+    for r in responses:
+        if r.get("condition", "unknown") == state.condition:
+            state.human_counts[r["response_type"]] += 1
+
+
+def ingest_human_files(state, folder="behavioral_responses"):
+    """
+    Add responses from behavioral files not seen before. Files that cannot be
+    parsed yet (still being copied) are retried on the next call.
+    Returns # of new files.
+    """
+    new_files = sorted(
+        fname for fname in os.listdir(folder)
+        if fname.endswith(".json") and fname not in state.seen_files
+    )
+    n_new = 0
+    for fname in new_files:
+        try:
+            with open(os.path.join(folder, fname), "r") as f:
+                data = json.load(f)
+        except ValueError:
+            continue
+        _add_responses(state, data["responses"])
+        state.seen_files.add(fname)
+        n_new += 1
+    return n_new
+
+
+def ingest_summary_records(state, url):
+    """
+    Add records from the backend summary endpoint added since the last call.
+    Records of participants already counted are skipped.
+    Returns # of new records.
+    """
+    query = urllib.parse.urlencode({"since": state.summary_cursor})
+    with urllib.request.urlopen(f"{url}?{query}") as resp:
+        out = json.load(resp)
+    new = [r for r in out["records"] if r["participant"] not in state.seen_participants]
+    _add_responses(state, new)
+    state.seen_participants.update(r["participant"] for r in new)
+    state.summary_cursor = out["cursor"]
+    return len(new)
+
+
+def rescore(state):
+    """KL loss of every configuration against the current human counts."""
+    p = np.array([state.human_counts.get(rt, 0) for rt in RESPONSE_TYPES], dtype=float)
+    p = p / p.sum()
+    losses = kl_losses(p, state.model_dists)
+
+    results_df = pd.DataFrame(state.configs)
+    results_df["loss"] = losses
+    return results_df
+
+
+def write_fit(results_df, grid_file="results/model_fit_grid.csv",
+              params_file="results/best_model_params.json"):
+    results_df.to_csv(grid_file, index=False)
+
+    best_row = results_df.loc[results_df["loss"].idxmin()]
+    best_params = best_params_from_row(best_row)
+    with open(params_file, "w") as f:
+        json.dump(best_params, f, indent=2)
+
+    return best_params, float(best_row["loss"])
+
+
+def run_online_fit(trials, obj_by_id, folder="behavioral_responses",
+                   summary_url=None, interval=5.0, fit_lambda_noise=False):
+    """
+    Poll for new participants and refit after each batch. Runs until
+    interrupted.
+    """
+    print("Preparing model distributions...")
+    state = start_online_fit(trials, obj_by_id, fit_lambda_noise=fit_lambda_noise)
+
+    print("Watching for new participants...")
+    while True:
+        if summary_url:
+            n_new = ingest_summary_records(state, summary_url)
+        else:
+            n_new = ingest_human_files(state, folder)
+
+        if n_new and sum(state.human_counts.values()):
+            t0 = time.perf_counter()
+            best_params, best_loss = write_fit(rescore(state))
+            dt = (time.perf_counter() - t0) * 1000
+            print(f"+{n_new} new, {sum(state.human_counts.values())} responses: "
+                  f"best {best_params}, loss={best_loss:.4f} ({dt:.1f} ms)")
+
+        time.sleep(interval)
+
+
+# Cross-validation. Model simulations do not depend on the human data, so
+# every configuration is simulated once (per-trial counts, via the cache,
+# in parallel) and each fold only re-aggregates human counts and rescores,
+# which takes microseconds and runs in-process.
+
+def _normalize(counts):
+    total = counts.sum(axis=-1, keepdims=True)
+    return counts / np.where(total == 0, 1, total)
+
+
+def _run_fold(fold, held_out, M, H, mode):
+    """Fit on everything outside held_out, score the best config on held_out."""
+
+    if mode == "participant":
+        mask = np.zeros(H.shape[0], dtype=bool)
+        mask[held_out] = True
+        human_train = H[~mask].sum(axis=(0, 1))
+        human_test = H[mask].sum(axis=(0, 1))
+        model_train = model_test = _normalize(M.sum(axis=1))
+    else:
+        mask = np.zeros(H.shape[1], dtype=bool)
+        mask[held_out] = True
+        human_train = H[:, ~mask].sum(axis=(0, 1))
+        human_test = H[:, mask].sum(axis=(0, 1))
+        model_train = _normalize(M[:, ~mask].sum(axis=1))
+        model_test = _normalize(M[:, mask].sum(axis=1))
+
+    if human_train.sum() == 0 or human_test.sum() == 0:
+        return None
+
+    train_losses = kl_losses(_normalize(human_train), model_train)
+    best = int(np.argmin(train_losses))
+    test_loss = float(kl_losses(_normalize(human_test), model_test[best]))
+
+    return {
+        "fold": fold,
+        "n_held_out": len(held_out),
+        "n_train_responses": int(human_train.sum()),
+        "n_test_responses": int(human_test.sum()),
+        "best_index": best,
+        "train_loss": float(train_losses[best]),
+        "test_loss": test_loss,
+    }
+
+
+def make_folds(n, k=None, seed=0):
+    """Index folds over n units: leave-one-out if k is None, else k shuffled folds."""
+    idx = list(range(n))
+    if k is None or k >= n:
+        return [[i] for i in idx]
+    random.Random(seed).shuffle(idx)
+    return [sorted(idx[f::k]) for f in range(k)]
+
+
+def cross_validate_fit(human_df, trials, obj_by_id, mode="participant", k=None,
+                       cache=None, fit_lambda_noise=False, workers=None, seed=0):
+    """
+    Out-of-sample fit quality of the grid search.
+
+    mode "participant": folds over participants (leave-one-participant-out
+        when k is None). The model side is pooled over all trials.
+    mode "trial": folds over trials; model and human distributions are both
+        restricted to the training / held-out trials.
+
+    Each fold picks the configuration with the lowest KL on its training
+    data and reports KL on the held-out data. Returns a per-fold DataFrame.
+    workers: processes for simulating configurations missing from the cache.
+    """
+    configs = grid_configs(fit_lambda_noise)
+    cache = {} if cache is None else cache
+    fill_sim_cache(configs, trials, obj_by_id, cache, workers or os.cpu_count() or 1)
+
+    trial_ids = [t.id for t in trials]
+    stimuli = stimuli_hash(trials, obj_by_id)
+    model_counts = np.array([
+        [counts[tid] for tid in trial_ids]
+        for counts in (cache[sim_cache_key(params, trials, obj_by_id, stimuli=stimuli)]
+                       for params in configs)
+    ], dtype=float)                                    # (configs, trials, 4)
+
+    human_df = human_df[human_df["condition"] == "normal"]
+    participants = sorted(human_df["participant"].unique())
+    p_index = {p: i for i, p in enumerate(participants)}
+    t_index = {tid: i for i, tid in enumerate(trial_ids)}
+    human_counts = np.zeros((len(participants), len(trial_ids), len(RESPONSE_TYPES)))
+    for row in human_df.itertuples():
+        human_counts[p_index[row.participant], t_index[row.trial_id],
+                     RESPONSE_TYPES.index(row.response_type)] += 1
+
+    n_units = len(participants) if mode == "participant" else len(trial_ids)
+    folds = list(enumerate(make_folds(n_units, k, seed)))
+
+    rows = [_run_fold(fold, held_out, model_counts, human_counts, mode)
+            for fold, held_out in folds]
+
+    results = []
+    for row in rows:
+        if row is None:
+            continue
+        fold_ids = participants if mode == "participant" else trial_ids
+        row["held_out"] = ";".join(fold_ids[i] for i in folds[row["fold"]][1])
+        row.update(configs[row.pop("best_index")])
+        results.append(row)
+    return pd.DataFrame(results)
+
+
 def main():
+    parser = argparse.ArgumentParser(description="Fit the model to human data.")
+    parser.add_argument("--online", action="store_true",
+                        help="keep running and refit whenever new participants arrive")
+    parser.add_argument("--summary-url", default=None,
+                        help="with --online, poll the backend summary endpoint "
+                             "instead of behavioral_responses/")
+    parser.add_argument("--interval", type=float, default=5.0,
+                        help="with --online, seconds between polls")
+    parser.add_argument("--fit-lambda-noise", action="store_true",
+                        help="also fit LAMBDA and NOISE (5-D search)")
+    parser.add_argument("--random", type=int, default=None, metavar="N",
+                        help="evaluate N randomly drawn grid configurations")
+    parser.add_argument("--cv", choices=["participant", "trial"], default=None,
+                        help="cross-validate over participants or trials")
+    parser.add_argument("--folds", type=int, default=None,
+                        help="with --cv, number of folds (default: leave-one-out)")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="with --cv, worker processes for uncached simulations "
+                             "(default: all cores)")
+    args = parser.parse_args()
+
+    if args.cv:
+        human_df = load_human_data()
+        objects, obj_by_id, trials = load_stimuli("../src/stimuli.json")
+        cache = load_sim_cache()
+        cv_df = cross_validate_fit(human_df, trials, obj_by_id, mode=args.cv, k=args.folds,
+                                   cache=cache, fit_lambda_noise=args.fit_lambda_noise,
+                                   workers=args.workers)
+        save_sim_cache(cache)
+        cv_df.to_csv("results/model_fit_cv.csv", index=False)
+        se = cv_df["test_loss"].std(ddof=1) / np.sqrt(len(cv_df)) if len(cv_df) > 1 else float("nan")
+        print(cv_df.to_string(index=False))
+        print(f"\nMean held-out KL: {cv_df['test_loss'].mean():.4f} (SE {se:.4f}), "
+              f"mean in-sample KL: {cv_df['train_loss'].mean():.4f}")
+        print("Saved: model_fit_cv.csv")
+        return
+
+    if args.online:
+        objects, obj_by_id, trials = load_stimuli("../src/stimuli.json")
+        try:
+            run_online_fit(trials, obj_by_id, summary_url=args.summary_url,
+                           interval=args.interval, fit_lambda_noise=args.fit_lambda_noise)
+        except KeyboardInterrupt:
+            pass
+        return
+
     print("Loading human data...")
     human_df = load_human_data()
 
@@ -160,7 +638,9 @@ def main():
     best_params, results_df = grid_search_fit(
         human_df=human_df,
         trials=trials,
-        obj_by_id=obj_by_id
+        obj_by_id=obj_by_id,
+        fit_lambda_noise=args.fit_lambda_noise,
+        n_random=args.random,
     )
 
     # Save the best params
@@ -0,0 +1,215 @@
+"""
+Parameter recovery and posterior-predictive benchmark for the fitting pipeline.
+
+For each replicate:
+- Draw ground-truth parameters (from the fitting grid, or continuous ranges)
+- Simulate synthetic participants with run_experiment_parametric: one
+  chain on each of 3 randomly drawn trials, matching the "normal" block of
+  the experiment that the real fit uses
+- Refit with the same KL grid search as grid_search_fit
+- Record recovery error, the fit's loss and runtime
+
+Model distributions for the fitting grid come from the simulation cache
+(results/model_sim_cache.json), so each refit is only a rescoring; missing
+grid entries are simulated in parallel first. Simulations use the
+posterior-table fast path. Replicates run in parallel across cores;
+replicate i always uses seed (seed, i), so results do not depend on the
+number of workers.
+
+Usage:
+    python recovery.py --replicates 1000 --participants 30 --workers 8
+"""
+
+import argparse
+import os
+import random
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from run_model import build_count_stats, load_stimuli
+from model_fit import (
+    NUM_CHAINS,
+    RESPONSE_TYPES,
+    SIM_CACHE_FILE,
+    counts_to_dist,
+    dist_to_vec,
+    fill_sim_cache,
+    grid_configs,
+    kl_losses,
+    load_sim_cache,
+    parallel_map,
+    save_sim_cache,
+    sim_cache_key,
+    simulate_model_counts,
+    stimuli_hash,
+)
+
+
+# Ranges for --continuous ground truth
+CONTINUOUS_RANGES = {
+    "p_add": (0.1, 0.9),
+    "steps": (100, 800),
+    "temperature": (0.5, 2.0),
+    "lambda": (0.3, 2.0),
+    "noise": (0.01, 0.2),
+}
+
+# Trials per participant in the "normal" condition (App.js getTrialCondition)
+TRIALS_PER_PARTICIPANT = 3
+
+# Per-worker state, set once by _init_worker
+_worker = {}
+
+
+def replicate_seed(seed, i):
+    return seed * 1_000_003 + i
+
+
+def draw_params(rng, configs, continuous):
+    if not continuous:
+        return dict(rng.choice(configs))
+    params = {}
+    for k in configs[0]:
+        lo, hi = CONTINUOUS_RANGES[k]
+        params[k] = rng.randint(lo, hi) if k == "steps" else rng.uniform(lo, hi)
+    return params
+
+
+def _init_worker(trials, obj_by_id, count_stats, configs=None, model_dists=None):
+    _worker.update(
+        trials=trials, obj_by_id=obj_by_id, count_stats=count_stats,
+        configs=configs, model_dists=model_dists,
+    )
+
+
+def run_replicate(args):
+    i, seed, n_participants, continuous = args
+    w = _worker
+    t0 = time.perf_counter()
+
+    rseed = replicate_seed(seed, i)
+    rng = random.Random(rseed)
+    truth = draw_params(rng, w["configs"], continuous)
+
+    # Participants seeing each trial; then one chain per participant per trial
+    seen_by = Counter()
+    for _ in range(n_participants):
+        seen_by.update(t.id for t in rng.sample(w["trials"], TRIALS_PER_PARTICIPANT))
+
+    # run_model draws from the global RNG
+    random.seed(rseed)
+    counts = {}
+    for trial in w["trials"]:
+        if seen_by[trial.id]:
+            counts.update(simulate_model_counts(
+                truth, [trial], w["obj_by_id"],
+                num_chains=seen_by[trial.id], count_stats=w["count_stats"],
+            ))
+    human_vec = dist_to_vec(counts_to_dist(counts))
+    t_sim = time.perf_counter() - t0
+
+    losses = kl_losses(human_vec, w["model_dists"])
+    best = int(np.argmin(losses))
+    fit = w["configs"][best]
+
+    row = {"replicate": i, "seed": rseed}
+    for k in truth:
+        row[f"true_{k}"] = truth[k]
+        row[f"fit_{k}"] = fit[k]
+        row[f"err_{k}"] = abs(fit[k] - truth[k])
+    row["exact"] = (not continuous) and fit == truth
+    row["fit_loss"] = float(losses[best])
+    for rt, v in zip(RESPONSE_TYPES, human_vec):
+        row[f"synthetic_{rt}"] = float(v)
+    row["sim_s"] = t_sim
+    row["total_s"] = time.perf_counter() - t0
+    return row
+
+
+def prepare_grid(trials, obj_by_id, count_stats, fit_lambda_noise, workers=1,
+                 cache_file=SIM_CACHE_FILE):
+    """Model distribution for every fitting configuration, via the simulation cache."""
+    configs = grid_configs(fit_lambda_noise)
+    cache = load_sim_cache(cache_file)
+
+    n_new = fill_sim_cache(configs, trials, obj_by_id, cache, workers, count_stats)
+    if n_new:
+        print(f"Simulated {n_new} uncached grid configurations.")
+        save_sim_cache(cache, cache_file)
+
+    stimuli = stimuli_hash(trials, obj_by_id)
+    model_dists = np.array([
+        dist_to_vec(counts_to_dist(cache[sim_cache_key(params, trials, obj_by_id, NUM_CHAINS,
+                                                       stimuli)]))
+        for params in configs
+    ])
+    return configs, model_dists
+
+
+def run_recovery(trials, obj_by_id, n_replicates=100, n_participants=30, seed=0,
+                 workers=None, continuous=False, fit_lambda_noise=False):
+    workers = workers or os.cpu_count() or 1
+    count_stats = build_count_stats(trials, obj_by_id)
+    configs, model_dists = prepare_grid(trials, obj_by_id, count_stats, fit_lambda_noise, workers)
+
+    jobs = [(i, seed, n_participants, continuous) for i in range(n_replicates)]
+    init_args = (trials, obj_by_id, count_stats, configs, model_dists)
+
+    t0 = time.perf_counter()
+    rows = parallel_map(run_replicate, jobs, workers, _init_worker, init_args)
+    elapsed = time.perf_counter() - t0
+
+    return pd.DataFrame(rows), elapsed
+
+
+def summarize(df, elapsed):
+    print(f"\nReplicates: {len(df)} in {elapsed:.1f}s "
+          f"({len(df) / elapsed:.1f}/s, mean {df['total_s'].mean() * 1000:.1f} ms each)")
+    for col in df.columns:
+        if col.startswith("err_"):
+            k = col[len("err_"):]
+            print(f"  {k:12s} mean abs error {df[col].mean():.4f}  "
+                  f"exact {np.mean(df[col] == 0):.1%}")
+    if df["exact"].any():
+        print(f"  all parameters recovered exactly: {df['exact'].mean():.1%}")
+    print(f"  fit loss: median {df['fit_loss'].median():.4f}, "
+          f"95th pct {df['fit_loss'].quantile(0.95):.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parameter recovery benchmark.")
+    parser.add_argument("--replicates", type=int, default=100)
+    parser.add_argument("--participants", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="worker processes (default: all cores)")
+    parser.add_argument("--continuous", action="store_true",
+                        help="draw ground truth from continuous ranges instead of the grid")
+    parser.add_argument("--fit-lambda-noise", action="store_true",
+                        help="also recover LAMBDA and NOISE (5-D grid)")
+    parser.add_argument("--out", default="results/recovery.csv")
+    args = parser.parse_args()
+
+    print("Loading stimuli...")
+    objects, obj_by_id, trials = load_stimuli("../src/stimuli.json")
+
+    print("Running recovery study...")
+    df, elapsed = run_recovery(
+        trials, obj_by_id,
+        n_replicates=args.replicates,
+        n_participants=args.participants,
+        seed=args.seed,
+        workers=args.workers,
+        continuous=args.continuous,
+        fit_lambda_noise=args.fit_lambda_noise,
+    )
+    df.to_csv(args.out, index=False)
+    summarize(df, elapsed)
+    print(f"\nSaved: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import random
 import json
 import csv
 from dataclasses import dataclass
+from itertools import product
 from typing import List, Dict, Any
 
 
@@ -88,22 +89,127 @@ def predicts(h: List[str], obj: Obj) -> bool:
     return all(feature_satisfied(f, obj) for f in h)
 
 
+# Defaults; both can be passed explicitly and fitted like p_add/steps/temperature.
 LAMBDA = 0.7
 NOISE = 0.05
 
-def log_prior(h: List[str]) -> float:
-    return -LAMBDA * len(h)
+def log_prior(h: List[str], lam: float = LAMBDA) -> float:
+    return -lam * len(h)
 
-def log_likelihood(h: List[str], examples: List[Example], obj_by_id):
+def log_likelihood(h: List[str], examples: List[Example], obj_by_id, noise: float = NOISE):
+    log_hit = math.log(1 - noise)
+    log_miss = math.log(noise)
     ll = 0.0
     for ex in examples:
         obj = obj_by_id[ex.object_id]
         pred = 1 if predicts(h, obj) else 0
-        ll += math.log(1 - NOISE) if pred == ex.label else math.log(NOISE)
+        ll += log_hit if pred == ex.label else log_miss
     return ll
 
-def log_posterior(h: List[str], examples: List[Example], obj_by_id):
-    return log_prior(h) + log_likelihood(h, examples, obj_by_id)
+def log_posterior(h: List[str], examples: List[Example], obj_by_id,
+                  lam: float = LAMBDA, noise: float = NOISE):
+    return log_prior(h, lam) + log_likelihood(h, examples, obj_by_id, noise)
+
+
+# Hypotheses hold at most one feature per dimension, so each one is encoded
+# as an integer: a value per dimension (0 = unused, 1/2 = first/second
+# feature of DIMENSION_FEATURES[d]) packed in base 3. Codes index
+# hypothesis_space(), and all per-hypothesis tables below are lists
+# indexed by code.
+
+DIMENSION_FEATURES = [
+    ("circle", "square"),
+    ("red", "blue"),
+    ("solid", "striped"),
+    ("big", "small"),
+]
+
+DIM_WEIGHTS = (27, 9, 3, 1)
+
+# feature -> (dimension, value)
+FEATURE_CODES = {
+    f: (d, v + 1) for d, fs in enumerate(DIMENSION_FEATURES) for v, f in enumerate(fs)
+}
+
+# (dimension, value) add moves in ALL_FEATURES order, for each bitmask of
+# used dimensions -- the same list available_add_features() builds.
+ADD_MOVES = [
+    tuple(FEATURE_CODES[f] for f in ALL_FEATURES if not used >> FEATURE_CODES[f][0] & 1)
+    for used in range(1 << len(DIMENSION_FEATURES))
+]
+
+def hypothesis_space():
+    """Every hypothesis with at most one feature per dimension (3^4 = 81), in code order."""
+    return [
+        [f for f in choice if f is not None]
+        for choice in product(*[(None,) + fs for fs in DIMENSION_FEATURES])
+    ]
+
+HYPOTHESES = hypothesis_space()
+
+def hypothesis_code(h: List[str]) -> int:
+    code = 0
+    for f in h:
+        d, v = FEATURE_CODES[f]
+        code += DIM_WEIGHTS[d] * v
+    return code
+
+
+# The log posterior only depends on three counts per hypothesis:
+#   -lam * length + n_correct * log(1 - noise) + n_incorrect * log(noise)
+# The counts are fixed per trial, so they are computed once and any
+# (lam, noise) pair just reweights them.
+
+def count_correct(h: List[str], trial: Trial, obj_by_id) -> int:
+    correct = 0
+    for ex in trial.examples:
+        pred = 1 if predicts(h, obj_by_id[ex.object_id]) else 0
+        correct += int(pred == ex.label)
+    return correct
+
+def trial_count_stats(trial: Trial, obj_by_id):
+    """(length, n_correct, n_incorrect) for every hypothesis code."""
+    stats = []
+    for h in HYPOTHESES:
+        correct = count_correct(h, trial, obj_by_id)
+        stats.append((len(h), correct, len(trial.examples) - correct))
+    return stats
+
+def build_count_stats(trials, obj_by_id):
+    """trial_count_stats for every trial, keyed by trial id."""
+    return {t.id: trial_count_stats(t, obj_by_id) for t in trials}
+
+def posterior_table(stats, lam: float = LAMBDA, noise: float = NOISE):
+    """Log posterior for every hypothesis code, from trial_count_stats."""
+    log_hit = math.log(1 - noise)
+    log_miss = math.log(noise)
+    return [
+        -lam * length + correct * log_hit + incorrect * log_miss
+        for length, correct, incorrect in stats
+    ]
+
+
+# Per-trial tables for run_chain. The exact log posteriors come from
+# log_posterior itself, so chains are bit-for-bit identical to evaluating
+# the examples at every step.
+def correct_table(stats):
+    """Number of correctly classified examples for every hypothesis code."""
+    return [correct for _, correct, _ in stats]
+
+def exact_posterior_table(trial: Trial, obj_by_id, lam: float = LAMBDA, noise: float = NOISE):
+    """log_posterior for every hypothesis code."""
+    return [log_posterior(h, trial.examples, obj_by_id, lam, noise) for h in HYPOTHESES]
+
+class _LazyPosterior(dict):
+    """log_posterior by hypothesis code, computed on first lookup."""
+
+    def __init__(self, trial: Trial, obj_by_id, lam: float, noise: float):
+        super().__init__()
+        self.args = (trial.examples, obj_by_id, lam, noise)
+
+    def __missing__(self, code):
+        lp = self[code] = log_posterior(HYPOTHESES[code], *self.args)
+        return lp
 
 
 def used_dims(h):
@@ -147,6 +253,10 @@ def propose(h, p_add):
     return new_h, move
 
 
+def _features(order, vals):
+    return [DIMENSION_FEATURES[d][vals[d] - 1] for d in order]
+
+
 def run_chain(
     trial: Trial,
     condition_name: str,
@@ -155,32 +265,110 @@ def run_chain(
     temperature: float,
     chain_idx: int,
     obj_by_id,
+    lam: float = LAMBDA,
+    noise: float = NOISE,
+    lp_table=None,
+    correct=None,
+    instrument=None,
 ):
-    current_h = trial.hypothesis.copy()
-    current_lp = log_posterior(current_h, trial.examples, obj_by_id)
+    """
+    Run one MCMC chain from the trial's initial hypothesis.
+
+    The chain state is integer-encoded (a value per dimension, the hypothesis
+    code, a bitmask of used dimensions and the dimensions in insertion
+    order) and scored by table lookup, so steps allocate nothing. Proposals
+    draw random numbers exactly as propose() does, so results are identical
+    to the list-based implementation.
+
+    lp_table (from exact_posterior_table or posterior_table) and correct
+    (from correct_table) are per-trial tables shared by many chains. Without
+    them the chain scores only the hypotheses it visits, so a single call
+    stays cheap; lam and noise only apply in that case.
+    instrument: optional hooks from instrumentation.py (counters, timers,
+    trajectory traces). They never consume random numbers.
+    """
+    vals = [0] * len(DIMENSION_FEATURES)
+    order = []
+    for f in trial.hypothesis:
+        d, v = FEATURE_CODES[f]
+        if vals[d]:
+            raise ValueError(f"Hypothesis {trial.hypothesis} has two features in one dimension")
+        vals[d] = v
+        order.append(d)
+    init_vals = vals.copy()
+    used = 0
+    code = 0
+    for d in order:
+        used |= 1 << d
+        code += DIM_WEIGHTS[d] * vals[d]
+
+    lp_tab = _LazyPosterior(trial, obj_by_id, lam, noise) if lp_table is None else lp_table
+    current_lp = lp_tab[code]
 
     add_moves = 0
     sub_moves = 0
 
-    for _ in range(steps):
-        proposal, move_type = propose(current_h, p_add)
-        if move_type == "none":
+    rec = None
+    if instrument is not None:
+        rec = instrument.start_chain(trial, chain_idx, trial.hypothesis.copy())
+
+    rand = random.random
+    choice = random.choice
+    exp = math.exp
+
+    for step in range(steps):
+        adds = ADD_MOVES[used]
+        if not adds and not order:
+            if rec is not None:
+                rec.step(step, "none", False, _features(order, vals))
             continue
 
-        prop_lp = log_posterior(proposal, trial.examples, obj_by_id)
+        if not adds:
+            do_add = False
+        elif not order:
+            do_add = True
+        else:
+            do_add = rand() < p_add
+
+        if do_add:
+            d, v = choice(adds)
+            prop_code = code + DIM_WEIGHTS[d] * v
+        else:
+            d = choice(order)
+            prop_code = code - DIM_WEIGHTS[d] * vals[d]
+
+        prop_lp = lp_tab[prop_code]
         delta = prop_lp - current_lp
-        accept = min(1.0, math.exp(delta / temperature))
+        accept = min(1.0, exp(delta / temperature))
 
-        if random.random() < accept:
-            current_h = proposal
+        accepted = rand() < accept
+        if accepted:
+            code = prop_code
             current_lp = prop_lp
-            if move_type == "additive": add_moves += 1
-            else: sub_moves += 1
-
-    final_h = current_h
-
-    removed = [f for f in trial.hypothesis if f not in final_h]
-    added   = [f for f in final_h if f not in trial.hypothesis]
+            if do_add:
+                vals[d] = v
+                order.append(d)
+                used |= 1 << d
+                add_moves += 1
+            else:
+                vals[d] = 0
+                order.remove(d)
+                used &= ~(1 << d)
+                sub_moves += 1
+
+        if rec is not None:
+            rec.step(step, "additive" if do_add else "subtractive", accepted,
+                     _features(order, vals))
+
+    final_h = _features(order, vals)
+    if rec is not None:
+        rec.finish(final_h)
+
+    removed = added = False
+    for d in range(len(DIMENSION_FEATURES)):
+        if vals[d] != init_vals[d]:
+            removed = removed or init_vals[d] != 0
+            added = added or vals[d] != 0
 
     if removed and not added:
         resp_type = "subtractive"
@@ -191,13 +379,10 @@ def run_chain(
     else:
         resp_type = "nochange"
 
-    correct = 0
-    for ex in trial.examples:
-        obj = obj_by_id[ex.object_id]
-        pred = 1 if predicts(final_h, obj) else 0
-        correct += int(pred == ex.label)
-
-    accuracy = correct / len(trial.examples)
+    if correct is None:
+        accuracy = count_correct(HYPOTHESES[code], trial, obj_by_id) / len(trial.examples)
+    else:
+        accuracy = correct[code] / len(trial.examples)
 
     return {
         "trial_id": trial.id,
@@ -216,18 +401,41 @@ def run_chain(
 
 
 
-def run_experiment_parametric(trials, obj_by_id, p_add, steps, temperature, num_chains):
+def run_experiment_parametric(trials, obj_by_id, p_add, steps, temperature, num_chains,
+                              lam=LAMBDA, noise=NOISE, count_stats=None, instrument=None):
+    """
+    Run num_chains chains per trial. Pass count_stats (from build_count_stats)
+    to score hypotheses with precomputed posterior tables instead of
+    re-evaluating the examples at every step, and instrument to profile or
+    trace the chains (see instrumentation.py).
+    """
+    condition_name = f"p_add={p_add}_steps={steps}_temp={temperature}"
+    if (lam, noise) != (LAMBDA, NOISE):
+        condition_name += f"_lambda={lam}_noise={noise}"
+
     results = []
     for trial in trials:
+        if count_stats is not None:
+            stats = count_stats[trial.id]
+            lp_table = posterior_table(stats, lam, noise)
+        else:
+            stats = trial_count_stats(trial, obj_by_id)
+            lp_table = exact_posterior_table(trial, obj_by_id, lam, noise)
+        correct = correct_table(stats)
         for chain_idx in range(num_chains):
             out = run_chain(
                 trial=trial,
-                condition_name=f"p_add={p_add}_steps={steps}_temp={temperature}",
+                condition_name=condition_name,
                 p_add=p_add,
                 steps=steps,
                 temperature=temperature,
                 chain_idx=chain_idx,
                 obj_by_id=obj_by_id,
+                lam=lam,
+                noise=noise,
+                lp_table=lp_table,
+                correct=correct,
+                instrument=instrument,
             )
             results.append(out)
     return results
@@ -253,66 +461,44 @@ def save_csv(results, filename):
 
 
 
-def main():
-    OUTPUT_DIR = "results"
-    print("Loading stimuli ...")
-    objects, obj_by_id, trials = load_stimuli("../src/stimuli.json")
-
-
-    print("\nRunning BASELINE experiment ...")
-    baseline = run_experiment_parametric(
-        trials, obj_by_id,
-        p_add=0.5, steps=500, temperature=1.0,
-        num_chains=50
-    )
-    save_json(baseline, f"{OUTPUT_DIR}/results_baseline.json")
-    save_csv(baseline, f"{OUTPUT_DIR}/results_baseline.csv")
-
-
-
-    print("\nRunning COGNITIVE LOAD experiment ...")
+def experiment_sweeps():
+    """
+    The configurations of each experiment, in run order. Each entry is a
+    dict of run_experiment_parametric keyword arguments.
+    """
+    baseline = [dict(p_add=0.5, steps=500, temperature=1.0, num_chains=50)]
 
     steps_list = [50, 150, 300, 500, 800]
     temps_list = [1.0, 1.5, 2.0, 3.0]
+    cognitive_load = (
+        [dict(p_add=0.5, steps=steps, temperature=1.0, num_chains=30) for steps in steps_list]
+        + [dict(p_add=0.5, steps=500, temperature=temp, num_chains=30) for temp in temps_list]
+    )
 
-    cog_results = []
-
-    for steps in steps_list:
-        out = run_experiment_parametric(
-            trials, obj_by_id,
-            p_add=0.5, steps=steps, temperature=1.0,
-            num_chains=30
-        )
-        cog_results.extend(out)
-
-    for temp in temps_list:
-        out = run_experiment_parametric(
-            trials, obj_by_id,
-            p_add=0.5, steps=500, temperature=temp,
-            num_chains=30
-        )
-        cog_results.extend(out)
-
-    save_json(cog_results, f"{OUTPUT_DIR}/results_cognitive_load.json")
-    save_csv(cog_results, f"{OUTPUT_DIR}/results_cognitive_load.csv")
+    p_add_values = [0.1, 0.3, 0.5, 0.7, 0.9]
+    cueing = [dict(p_add=p, steps=500, temperature=1.0, num_chains=30) for p in p_add_values]
 
+    return {
+        "baseline": baseline,
+        "cognitive_load": cognitive_load,
+        "cueing": cueing,
+    }
 
 
-    print("\nRunning CUEING experiment ...")
+def main():
+    OUTPUT_DIR = "results"
+    print("Loading stimuli ...")
+    objects, obj_by_id, trials = load_stimuli("../src/stimuli.json")
 
-    p_add_values = [0.1, 0.3, 0.5, 0.7, 0.9]
-    cue_results = []
+    for name, configs in experiment_sweeps().items():
+        print(f"\nRunning {name.replace('_', ' ').upper()} experiment ...")
 
-    for p in p_add_values:
-        out = run_experiment_parametric(
-            trials, obj_by_id,
-            p_add=p, steps=500, temperature=1.0,
-            num_chains=30
-        )
-        cue_results.extend(out)
+        results = []
+        for config in configs:
+            results.extend(run_experiment_parametric(trials, obj_by_id, **config))
 
-    save_json(cue_results, f"{OUTPUT_DIR}/results_cueing.json")
-    save_csv(cue_results, f"{OUTPUT_DIR}/results_cueing.csv")
+        save_json(results, f"{OUTPUT_DIR}/results_{name}.json")
+        save_csv(results, f"{OUTPUT_DIR}/results_{name}.csv")
 
     print("\nAll experiments completed and saved.")
 
@@ -16,7 +16,7 @@ import pandas as pd
 import seaborn as sns
 import matplotlib.pyplot as plt
 from collections import Counter
-from run_model import run_experiment_parametric, load_stimuli
+from run_model import LAMBDA, NOISE, run_experiment_parametric, load_stimuli
 
 sns.set(style="whitegrid", context="talk")
 
@@ -124,6 +124,8 @@ def main():
     p_add = best_params["p_add"]
     steps = best_params["steps"]
     temperature = best_params["temperature"]
+    lam = best_params.get("lambda", LAMBDA)
+    noise = best_params.get("noise", NOISE)
 
     # Load stimuli to run model
     objects, obj_by_id, trials = load_stimuli("../src/stimuli.json")
@@ -137,7 +139,9 @@ def main():
         p_add=p_add,
         steps=steps,
         temperature=temperature,
-        num_chains=50
+        num_chains=50,
+        lam=lam,
+        noise=noise
     )
 
     model_df = pd.DataFrame(model_results)
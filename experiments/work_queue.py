@@ -0,0 +1,408 @@
+"""
+Run experiment sweeps and grid_search_fit across machines through a shared
+directory. No broker is needed: any filesystem all nodes can see (NFS, a
+cluster scratch volume, or a local directory for testing) is the queue.
+
+Layout of a queue directory:
+    manifest.json               what to run (kind, settings, human distribution)
+    shards/shard-00000.json     the configurations of each shard
+    leases/shard-00000.lease-G  claim of generation G, created with O_EXCL
+    leases/shard-00000.hb-G     heartbeat of generation G (mtime is touched)
+    out/shard-00000.json        shard results, written atomically
+    merged/                     merge() output (default)
+
+A worker claims a shard by creating the next lease generation with O_EXCL,
+so exactly one worker wins each generation. While it runs it touches the
+heartbeat file; a shard whose newest lease and heartbeat are older than the
+lease timeout is treated as abandoned and can be claimed again under the
+next generation. Each experiment configuration is seeded from (seed, its
+index in the sweep) and each grid configuration by its simulation cache key,
+so the merged output does not depend on the shard size, which worker runs a
+shard, or how often.
+
+Usage:
+    python work_queue.py init grid /shared/q --shard-size 4
+    python work_queue.py init experiment /shared/q --sweep cognitive_load
+    python work_queue.py worker /shared/q          # on every node, as often as wanted
+    python work_queue.py status /shared/q
+    python work_queue.py merge /shared/q           # once all shards are done
+"""
+
+import argparse
+import json
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+from run_model import (
+    build_count_stats,
+    experiment_sweeps,
+    load_stimuli,
+    run_experiment_parametric,
+    save_csv,
+    save_json,
+)
+from model_fit import (
+    NUM_CHAINS,
+    compute_distribution,
+    counts_to_dist,
+    dist_to_vec,
+    grid_configs,
+    kl_divergence,
+    load_human_data,
+    load_sim_cache,
+    save_sim_cache,
+    seeded_model_counts,
+    sim_cache_key,
+    write_fit,
+)
+
+
+HEARTBEAT_INTERVAL = 10.0
+LEASE_TIMEOUT = 60.0
+STIMULI_FILE = "../src/stimuli.json"
+
+
+def _write_json_atomic(path, obj):
+    tmp = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _shard_name(shard_id):
+    return f"shard-{shard_id:05d}"
+
+
+def init_queue(queue_dir, kind, configs, shard_size=1, seed=0, human_dist=None,
+               stimuli=STIMULI_FILE, name=None, lease_timeout=LEASE_TIMEOUT):
+    """
+    Split configs into shards of shard_size and write the queue directory.
+
+    kind "experiment": configs are run_experiment_parametric keyword dicts;
+        merge() concatenates the chain records.
+    kind "grid": configs are model_fit parameter dicts scored against
+        human_dist; merge() writes model_fit_grid.csv and best params.
+    """
+    if kind not in ("experiment", "grid"):
+        raise ValueError(f"Unknown sweep kind: {kind}")
+    if kind == "grid" and human_dist is None:
+        raise ValueError("A grid sweep needs human_dist")
+    if os.path.exists(os.path.join(queue_dir, "manifest.json")):
+        raise FileExistsError(f"Queue already initialised: {queue_dir}")
+
+    for sub in ("shards", "leases", "out"):
+        os.makedirs(os.path.join(queue_dir, sub), exist_ok=True)
+
+    starts = range(0, len(configs), shard_size)
+    for shard_id, start in enumerate(starts):
+        _write_json_atomic(
+            os.path.join(queue_dir, "shards", f"{_shard_name(shard_id)}.json"),
+            {"id": shard_id, "start": start, "configs": configs[start:start + shard_size]},
+        )
+
+    # The manifest goes last: workers ignore a queue without one.
+    _write_json_atomic(os.path.join(queue_dir, "manifest.json"), {
+        "kind": kind,
+        "name": name or kind,
+        "n_shards": len(starts),
+        "seed": seed,
+        "stimuli": os.path.abspath(stimuli),
+        "human_dist": human_dist,
+        "num_chains": NUM_CHAINS,
+        "lease_timeout": lease_timeout,
+    })
+    return len(starts)
+
+
+# ---- Leases ----
+
+def _lease_generations(queue_dir, shard_id):
+    prefix = f"{_shard_name(shard_id)}.lease-"
+    return sorted(
+        int(f[len(prefix):]) for f in os.listdir(os.path.join(queue_dir, "leases"))
+        if f.startswith(prefix) and f[len(prefix):].isdigit()
+    )
+
+
+def _lease_paths(queue_dir, shard_id, gen):
+    base = os.path.join(queue_dir, "leases", _shard_name(shard_id))
+    return f"{base}.lease-{gen}", f"{base}.hb-{gen}"
+
+
+def _last_alive(queue_dir, shard_id, gen):
+    times = []
+    for path in _lease_paths(queue_dir, shard_id, gen):
+        try:
+            times.append(os.stat(path).st_mtime)
+        except FileNotFoundError:
+            pass
+    return max(times, default=0.0)
+
+
+def is_done(queue_dir, shard_id):
+    return os.path.exists(os.path.join(queue_dir, "out", f"{_shard_name(shard_id)}.json"))
+
+
+def try_claim(queue_dir, shard_id, worker_id, lease_timeout=LEASE_TIMEOUT):
+    """
+    Claim a shard that is neither done nor validly leased. Returns the lease
+    generation on success, None otherwise.
+    """
+    if is_done(queue_dir, shard_id):
+        return None
+
+    gens = _lease_generations(queue_dir, shard_id)
+    if gens:
+        newest = gens[-1]
+        if time.time() - _last_alive(queue_dir, shard_id, newest) < lease_timeout:
+            return None
+        gen = newest + 1
+    else:
+        gen = 0
+
+    lease, heartbeat = _lease_paths(queue_dir, shard_id, gen)
+    try:
+        fd = os.open(lease, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None  # another worker won this generation
+    with os.fdopen(fd, "w") as f:
+        json.dump({"worker": worker_id, "claimed_at": time.time()}, f)
+    with open(heartbeat, "w"):
+        pass
+    return gen
+
+
+class Heartbeat:
+    """Touches a lease's heartbeat file in the background while a shard runs."""
+
+    def __init__(self, path, interval=HEARTBEAT_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# ---- Running shards ----
+
+def run_shard(manifest, shard, trials, obj_by_id, count_stats):
+    """Results of one shard: chain records, or loss rows plus model counts."""
+    if manifest["kind"] == "experiment":
+        records = []
+        for i, config in enumerate(shard["configs"], start=shard["start"]):
+            random.seed(f"{manifest['seed']}-{i}")
+            records.extend(run_experiment_parametric(trials, obj_by_id, **config))
+        return {"records": records}
+
+    human_vec = dist_to_vec(manifest["human_dist"])
+    rows, counts = [], {}
+    for params in shard["configs"]:
+        c = seeded_model_counts(params, trials, obj_by_id, manifest["num_chains"], count_stats)
+        counts[sim_cache_key(params, trials, obj_by_id, manifest["num_chains"])] = c
+        loss = kl_divergence(human_vec, dist_to_vec(counts_to_dist(c)))
+        rows.append({**params, "loss": float(loss)})
+    return {"rows": rows, "counts": counts}
+
+
+def run_worker(queue_dir, worker_id=None, poll=5.0, heartbeat_interval=HEARTBEAT_INTERVAL):
+    """
+    Claim and run shards until every shard is done. Returns the number of
+    shards this worker completed.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    manifest = _read_json(os.path.join(queue_dir, "manifest.json"))
+    lease_timeout = manifest["lease_timeout"]
+
+    objects, obj_by_id, trials = load_stimuli(manifest["stimuli"])
+    count_stats = build_count_stats(trials, obj_by_id)
+
+    n = manifest["n_shards"]
+    # Start at a worker-specific offset so workers rarely race for one shard.
+    offset = random.Random(worker_id).randrange(n) if n else 0
+    completed = 0
+
+    while True:
+        pending = [s for s in ((offset + i) % n for i in range(n)) if not is_done(queue_dir, s)]
+        if not pending:
+            return completed
+
+        claimed = False
+        for shard_id in pending:
+            gen = try_claim(queue_dir, shard_id, worker_id, lease_timeout)
+            if gen is None:
+                continue
+            claimed = True
+
+            shard = _read_json(os.path.join(queue_dir, "shards", f"{_shard_name(shard_id)}.json"))
+            _, heartbeat = _lease_paths(queue_dir, shard_id, gen)
+            print(f"[{worker_id}] running {_shard_name(shard_id)} (lease {gen})")
+            with Heartbeat(heartbeat, heartbeat_interval):
+                result = run_shard(manifest, shard, trials, obj_by_id, count_stats)
+
+            # Shards are deterministic, so if a slow worker and a re-claimer
+            # both finish, they write the same result.
+            _write_json_atomic(
+                os.path.join(queue_dir, "out", f"{_shard_name(shard_id)}.json"), result
+            )
+            completed += 1
+
+        if not claimed:
+            time.sleep(poll)  # everything left is leased; wait for it or for a lease to expire
+
+
+def queue_status(queue_dir):
+    manifest = _read_json(os.path.join(queue_dir, "manifest.json"))
+    now = time.time()
+    done = running = stale = 0
+    for shard_id in range(manifest["n_shards"]):
+        if is_done(queue_dir, shard_id):
+            done += 1
+            continue
+        gens = _lease_generations(queue_dir, shard_id)
+        if not gens:
+            continue
+        if now - _last_alive(queue_dir, shard_id, gens[-1]) < manifest["lease_timeout"]:
+            running += 1
+        else:
+            stale += 1
+    return {
+        "shards": manifest["n_shards"],
+        "done": done,
+        "running": running,
+        "stale": stale,
+        "pending": manifest["n_shards"] - done - running - stale,
+    }
+
+
+def merge(queue_dir, out_dir=None, sim_cache_file=None):
+    """
+    Combine shard outputs once every shard is done.
+
+    experiment: results_<name>.json / .csv in out_dir.
+    grid: model_fit_grid.csv and best_model_params.json in out_dir; with
+        sim_cache_file, the simulated model counts are added to that cache.
+    out_dir defaults to <queue_dir>/merged, so a merge never overwrites the
+    tracked outputs of run_model.py or model_fit.py by accident.
+    """
+    out_dir = out_dir or os.path.join(queue_dir, "merged")
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = _read_json(os.path.join(queue_dir, "manifest.json"))
+    missing = [s for s in range(manifest["n_shards"]) if not is_done(queue_dir, s)]
+    if missing:
+        raise RuntimeError(f"{len(missing)} shards not finished, e.g. {_shard_name(missing[0])}")
+
+    outputs = [
+        _read_json(os.path.join(queue_dir, "out", f"{_shard_name(s)}.json"))
+        for s in range(manifest["n_shards"])
+    ]
+
+    if manifest["kind"] == "experiment":
+        records = [r for out in outputs for r in out["records"]]
+        name = manifest["name"]
+        save_json(records, os.path.join(out_dir, f"results_{name}.json"))
+        save_csv(records, os.path.join(out_dir, f"results_{name}.csv"))
+        return records
+
+    results_df = pd.DataFrame([row for out in outputs for row in out["rows"]])
+    best_params, best_loss = write_fit(
+        results_df,
+        grid_file=os.path.join(out_dir, "model_fit_grid.csv"),
+        params_file=os.path.join(out_dir, "best_model_params.json"),
+    )
+    if sim_cache_file:
+        cache = load_sim_cache(sim_cache_file)
+        for out in outputs:
+            cache.update(out["counts"])
+        save_sim_cache(cache, sim_cache_file)
+
+    print("Best parameters:", best_params)
+    print("Best loss:", best_loss)
+    return results_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared-directory work queue for sweeps.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_init = sub.add_parser("init", help="create a queue")
+    p_init.add_argument("kind", choices=["grid", "experiment"])
+    p_init.add_argument("queue")
+    p_init.add_argument("--sweep", choices=sorted(experiment_sweeps()), default="baseline",
+                        help="experiment to shard (kind=experiment)")
+    p_init.add_argument("--fit-lambda-noise", action="store_true",
+                        help="5-D grid including LAMBDA and NOISE (kind=grid)")
+    p_init.add_argument("--shard-size", type=int, default=1)
+    p_init.add_argument("--seed", type=int, default=0)
+    p_init.add_argument("--lease-timeout", type=float, default=LEASE_TIMEOUT)
+
+    p_worker = sub.add_parser("worker", help="claim and run shards until none are left")
+    p_worker.add_argument("queue")
+    p_worker.add_argument("--worker-id", default=None)
+    p_worker.add_argument("--poll", type=float, default=5.0)
+
+    p_status = sub.add_parser("status", help="show shard counts")
+    p_status.add_argument("queue")
+
+    p_merge = sub.add_parser("merge", help="combine results once all shards are done")
+    p_merge.add_argument("queue")
+    p_merge.add_argument("--out-dir", default=None,
+                         help="where to write merged results (default: <queue>/merged)")
+    p_merge.add_argument("--sim-cache", default=None,
+                         help="grid only: also add simulations to this cache file")
+
+    args = parser.parse_args()
+
+    if args.command == "init":
+        if args.kind == "experiment":
+            configs = experiment_sweeps()[args.sweep]
+            human_dist, name = None, args.sweep
+        else:
+            configs = grid_configs(args.fit_lambda_noise)
+            human_df = load_human_data()
+            human_dist = compute_distribution(human_df[human_df["condition"] == "normal"])
+            human_dist = {k: float(v) for k, v in human_dist.items()}
+            name = "grid"
+        n = init_queue(args.queue, args.kind, configs, shard_size=args.shard_size,
+                       seed=args.seed, human_dist=human_dist, name=name,
+                       lease_timeout=args.lease_timeout)
+        print(f"Created {n} shards in {args.queue}")
+
+    elif args.command == "worker":
+        n = run_worker(args.queue, worker_id=args.worker_id, poll=args.poll)
+        print(f"No shards left; this worker completed {n}.")
+
+    elif args.command == "status":
+        print(queue_status(args.queue))
+
+    elif args.command == "merge":
+        merge(args.queue, out_dir=args.out_dir, sim_cache_file=args.sim_cache)
+        print("Merged.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+"""
+Concurrent load test for the submission endpoint in backend.py.
+
+Runs the FastAPI app in-process against a LocalVolume in a temporary
+directory (no Modal, no network) and fires EndScreen-shaped payloads at it
+with a fixed level of concurrency. Requests are spread over several app
+instances sharing the directory, each standing in for one container with
+its own summary shard and lock, so writes from different containers race
+the way they do on Modal. Reports:
+- throughput (requests / second)
+- p50 / p99 latency
+- lost writes (payloads that were acknowledged but are not on the volume)
+- duplicated writes (payloads stored more than once, or unexpected files)
+- submissions missing from the incremental summary tables
+- submissions missing from the summary endpoint's record feed
+
+Payloads are generated from src/stimuli.json with a seeded RNG, so runs are
+repeatable offline.
+
+Usage:
+    python loadtest.py --requests 500 --concurrency 100
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import anyio.to_thread
+import httpx
+
+from backend import LocalVolume, create_local_app, load_summary, read_summary
+
+
+STIMULI_FILE = os.path.join(os.path.dirname(__file__), "src", "stimuli.json")
+
+DIMENSIONS = {
+    "shape": ["circle", "square"],
+    "color": ["red", "blue"],
+    "fill": ["solid", "striped"],
+    "size": ["big", "small"],
+}
+
+# Same trial-position -> condition mapping as App.js
+CONDITIONS = ["normal"] * 3 + ["time_pressure"] * 3 + ["add_subtract_reminder"] * 3
+
+
+def make_payload(participant: int, trials, rng: random.Random):
+    """
+    Build one participant's submission the way EndScreen sends it:
+    {"responses": [...]} with one entry per trial.
+    """
+    start = datetime(2025, 12, 1) + timedelta(seconds=participant)
+    order = rng.sample(trials, len(trials))
+
+    responses = []
+    for i, trial in enumerate(order):
+        choices = {dim: [] for dim in DIMENSIONS}
+        for dim, values in DIMENSIONS.items():
+            if rng.random() < 0.5:
+                choices[dim] = [rng.choice(values)]
+        response_h = [f for sel in choices.values() for f in sel]
+        resp_type = (
+            "subtractive"
+            if all(f in trial["hypothesis"] for f in response_h)
+            else "additive"
+        )
+        rt_ms = rng.randint(2000, 60000)
+        start += timedelta(milliseconds=rt_ms)
+
+        responses.append({
+            "trial_id": trial["id"],
+            "initial_hypothesis": trial["hypothesis"],
+            "response_hypothesis": response_h,
+            "response_type": resp_type,
+            "condition": CONDITIONS[i] if i < len(CONDITIONS) else "normal",
+            "raw_feature_choices": choices,
+            "rt_ms": rt_ms,
+            # participant index makes every payload unique
+            "timestamp": start.isoformat(timespec="milliseconds") + "Z",
+        })
+
+    return {"responses": responses}
+
+
+def canonical(payload) -> str:
+    return json.dumps(payload, sort_keys=True)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile, q in [0, 100]."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+async def fire(clients, payloads, concurrency):
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def one(client, payload):
+        nonlocal failures
+        async with sem:
+            t0 = time.perf_counter()
+            resp = await client.post("/", json=payload)
+            latencies.append(time.perf_counter() - t0)
+            if resp.status_code != 200 or resp.json().get("status") != "ok":
+                failures += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(clients[i % len(clients)], p) for i, p in enumerate(payloads)))
+    elapsed = time.perf_counter() - t0
+
+    return latencies, failures, elapsed
+
+
+def check_volume(root, payloads):
+    """Compare what is on the volume with what was sent."""
+    sent = Counter(canonical(p) for p in payloads)
+
+    stored = Counter()
+    unreadable = 0
+    for fname in os.listdir(root):
+        if not fname.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(root, fname), "r") as f:
+                stored[canonical(json.load(f))] += 1
+        except (OSError, ValueError):
+            unreadable += 1
+
+    lost = sum(max(0, n - stored[key]) for key, n in sent.items())
+    duplicated = sum(max(0, n - sent.get(key, 0)) for key, n in stored.items())
+
+    # Submissions the summary tables and the record feed missed
+    files = sum(stored.values()) + unreadable
+    unsummarized = files - load_summary(root)["participants"]
+    delivered = {r["participant"] for r in read_summary(root, since="")["records"]}
+    undelivered = files - len(delivered)
+
+    return {
+        "files": files,
+        "unsummarized": unsummarized,
+        "undelivered": undelivered,
+        "lost": lost,
+        "duplicated": duplicated,
+        "unreadable": unreadable,
+    }
+
+
+def run_load_test(num_requests=500, concurrency=100, seed=0, commit_delay=0.0, root=None,
+                  containers=4):
+    with open(STIMULI_FILE, "r") as f:
+        trials = json.load(f)["trials"]
+
+    rng = random.Random(seed)
+    payloads = [make_payload(i, trials, rng) for i in range(num_requests)]
+
+    if root and os.path.isdir(root) and os.listdir(root):
+        raise ValueError(f"--root must be an empty directory: {root}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        volumes = [LocalVolume(root or tmp, commit_delay=commit_delay) for _ in range(containers)]
+        web_apps = [create_local_app(volume) for volume in volumes]
+
+        async def main():
+            # Sync handlers run on anyio's thread pool (40 threads by default);
+            # size it so --concurrency is not silently capped.
+            limiter = anyio.to_thread.current_default_thread_limiter()
+            limiter.total_tokens = max(limiter.total_tokens, concurrency)
+            clients = [
+                httpx.AsyncClient(transport=httpx.ASGITransport(app=web_app), base_url="http://local")
+                for web_app in web_apps
+            ]
+            try:
+                return await fire(clients, payloads, concurrency)
+            finally:
+                for client in clients:
+                    await client.aclose()
+
+        latencies, failures, elapsed = asyncio.run(main())
+        storage = check_volume(root or tmp, payloads)
+
+    return {
+        "requests": num_requests,
+        "concurrency": concurrency,
+        "containers": containers,
+        "seed": seed,
+        "failures": failures,
+        "commits": sum(volume.commits for volume in volumes),
+        "elapsed_s": elapsed,
+        "throughput_rps": num_requests / elapsed if elapsed > 0 else float("inf"),
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        **storage,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--containers", type=int, default=4,
+                        help="app instances (simulated containers) sharing the volume")
+    parser.add_argument("--commit-delay", type=float, default=0.0,
+                        help="simulated volume commit latency in seconds")
+    parser.add_argument("--root", default=None,
+                        help="write to this (empty) directory instead of a temp dir")
+    parser.add_argument("--json", default=None, help="also write the report here")
+    args = parser.parse_args()
+
+    report = run_load_test(
+        num_requests=args.requests,
+        concurrency=args.concurrency,
+        seed=args.seed,
+        commit_delay=args.commit_delay,
+        root=args.root,
+        containers=args.containers,
+    )
+
+    print(f"Requests:    {report['requests']} (concurrency {report['concurrency']}, "
+          f"{report['containers']} containers)")
+    print(f"Failures:    {report['failures']}")
+    print(f"Throughput:  {report['throughput_rps']:.1f} req/s")
+    print(f"Latency:     p50={report['p50_ms']:.1f} ms  p99={report['p99_ms']:.1f} ms")
+    print(f"Files:       {report['files']}")
+    print(f"Lost:        {report['lost']}")
+    print(f"Duplicated:  {report['duplicated']}")
+    print(f"Unsummarized: {report['unsummarized']}")
+    print(f"Undelivered: {report['undelivered']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    if (report["failures"] or report["lost"] or report["duplicated"]
+            or report["unreadable"] or report["unsummarized"] or report["undelivered"]):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()